@@ -0,0 +1,190 @@
+import base64
+import hashlib
+import hmac
+import http.client
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+GOOGLE_TOKEN_URL = os.environ.get('GOOGLE_TOKEN_URL', 'https://oauth2.googleapis.com/token')
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v3/certs')
+GOOGLE_HTTP_TIMEOUT = float(os.environ.get('GOOGLE_HTTP_TIMEOUT', '5'))
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+JWKS_DEFAULT_MAX_AGE = 3600
+JWKS_MIN_REFETCH_SECONDS = 30
+CLOCK_SKEW_SECONDS = 60
+
+# DigestInfo SHA-256 из RFC 8017, 9.2
+_SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')
+_MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class GoogleAuthError(Exception):
+    """Ответ Google или id_token не прошли проверку"""
+
+
+class HttpsPool:
+    """
+    Keep-alive подключения по хосту, живут между тёплыми вызовами функции.
+    Подключение выдаётся одному запросу за раз; после обрыва запрос повторяется
+    один раз на новом подключении (сервер мог закрыть простаивавшее).
+    """
+
+    def __init__(self, timeout: float = GOOGLE_HTTP_TIMEOUT):
+        self.timeout = timeout
+        self._idle: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, method: str, url: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + (f"?{parts.query}" if parts.query else '')
+        for attempt in range(2):
+            with self._lock:
+                idle = self._idle.get(key)
+                conn = idle.pop() if idle else None
+            reused = conn is not None
+            if conn is None:
+                conn = self._connect(*key)
+            try:
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.setdefault(key, []).append(conn)
+            return response.status, {k.lower(): v for k, v in response.getheaders()}, data
+        raise GoogleAuthError('Google is unreachable')
+
+
+pool = HttpsPool()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class JwksCache:
+    """Открытые ключи Google по kid; срок жизни - max-age из Cache-Control ответа"""
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL):
+        self.url = url
+        self._keys: Dict[str, Tuple[int, int]] = {}
+        self._expires_at = 0.0
+        self._fetched_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _fetch(self) -> None:
+        status, headers, data = pool.request('GET', self.url)
+        if status != 200:
+            raise GoogleAuthError(f'JWKS request failed: {status}')
+        keys = {}
+        for jwk in json.loads(data).get('keys', []):
+            if jwk.get('kty') == 'RSA':
+                keys[jwk['kid']] = (int.from_bytes(_b64decode(jwk['n']), 'big'), int.from_bytes(_b64decode(jwk['e']), 'big'))
+        match = _MAX_AGE_RE.search(headers.get('cache-control', ''))
+        max_age = int(match.group(1)) if match else JWKS_DEFAULT_MAX_AGE
+        now = time.monotonic()
+        self._keys, self._expires_at, self._fetched_at = keys, now + max_age, now
+
+    def get(self, kid: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            now = time.monotonic()
+            # Незнакомый kid означает ротацию у Google: перечитываем, но не чаще раза в 30 секунд
+            if now >= self._expires_at or (kid not in self._keys and now - self._fetched_at > JWKS_MIN_REFETCH_SECONDS):
+                self._fetch()
+            return self._keys.get(kid)
+
+
+jwks = JwksCache()
+
+
+def rsa_pkcs1_sha256_verify(message: bytes, signature: bytes, n: int, e: int) -> bool:
+    """RSASSA-PKCS1-v1_5 с SHA-256 (RS256): сравнение с ожидаемым EM, как в RFC 8017, 8.2.2"""
+    k = (n.bit_length() + 7) // 8
+    if len(signature) != k:
+        return False
+    s = int.from_bytes(signature, 'big')
+    if s >= n:
+        return False
+    em = pow(s, e, n).to_bytes(k, 'big')
+    t = _SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    if k < len(t) + 11:
+        return False
+    expected = b'\x00\x01' + b'\xff' * (k - len(t) - 3) + b'\x00' + t
+    return hmac.compare_digest(em, expected)
+
+
+def verify_id_token(id_token: str, client_id: str) -> Dict[str, Any]:
+    """Claims id_token после проверки подписи по JWKS, издателя, аудитории и срока"""
+    try:
+        header_b64, payload_b64, signature_b64 = id_token.split('.')
+        header = json.loads(_b64decode(header_b64))
+        claims = json.loads(_b64decode(payload_b64))
+        signature = _b64decode(signature_b64)
+    except ValueError:
+        raise GoogleAuthError('Malformed id_token')
+    if header.get('alg') != 'RS256':
+        raise GoogleAuthError('Unexpected id_token algorithm')
+    key = jwks.get(header.get('kid', ''))
+    if key is None or not rsa_pkcs1_sha256_verify(f"{header_b64}.{payload_b64}".encode(), signature, *key):
+        raise GoogleAuthError('Invalid id_token signature')
+    if claims.get('iss') not in GOOGLE_ISSUERS or claims.get('aud') != client_id:
+        raise GoogleAuthError('id_token was not issued for this client')
+    if claims.get('exp', 0) < time.time() - CLOCK_SKEW_SECONDS:
+        raise GoogleAuthError('id_token expired')
+    return claims
+
+
+def exchange_code(code: str, client_id: str, client_secret: str, redirect_uri: str) -> Dict[str, Any]:
+    """Обмен кода авторизации на токены через пул keep-alive подключений"""
+    status, _, data = pool.request(
+        'POST',
+        GOOGLE_TOKEN_URL,
+        body=urlencode({
+            'code': code,
+            'client_id': client_id,
+            'client_secret': client_secret,
+            'redirect_uri': redirect_uri,
+            'grant_type': 'authorization_code'
+        }).encode(),
+        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+    if status != 200:
+        raise GoogleAuthError(f'Token exchange failed: {status}')
+    return json.loads(data)
+
+
+def sign_in(code: str, client_id: str, client_secret: str, redirect_uri: str) -> Dict[str, Any]:
+    """Профиль пользователя из проверенного id_token: без отдельного запроса к userinfo"""
+    token_response = exchange_code(code, client_id, client_secret, redirect_uri)
+    id_token = token_response.get('id_token')
+    if not id_token:
+        raise GoogleAuthError('Token response has no id_token')
+    claims = verify_id_token(id_token, client_id)
+    # Без явного email_verified почта считается неподтверждённой
+    if not claims.get('email') or claims.get('email_verified') not in (True, 'true'):
+        raise GoogleAuthError('Google account email is not verified')
+    return {
+        'email': claims['email'].strip().lower(),
+        'name': claims.get('name', ''),
+        'picture': claims.get('picture', ''),
+        'sub': claims['sub']
+    }
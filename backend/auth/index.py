@@ -1,27 +1,15 @@
 import json
 import os
-import hashlib
-import secrets
 from typing import Dict, Any, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from db import get_db_connection, release_db_connection
+from passwords import PasswordHasherBusy, hash_password, verify_password, burn_verify
+from session_tokens import AUTH_ALLOW_USER_ID_HEADER, issue_token, verify_token, revoke_token, get_token, is_signed
+from google_oauth import sign_in
 from urllib.parse import urlencode
-import urllib.request
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(
-        os.environ['DATABASE_URL'],
-        cursor_factory=RealDictCursor
-    )
-
-def hash_password(password: str) -> str:
-    """Хеширование пароля с использованием SHA-256"""
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def generate_token() -> str:
-    """Генерация случайного токена"""
-    return secrets.token_urlsafe(32)
+def generate_token(user: Dict[str, Any]) -> str:
+    """Подписанный токен сессии: проверяется в любой функции без запроса к users"""
+    return issue_token(user['id'], user.get('role') or 'user')
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -37,7 +25,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -49,7 +37,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur = conn.cursor()
         
         if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
+            body_data = json.loads(event.get('body') or '{}')
             
             if action == 'register':
                 email = body_data.get('email', '').strip().lower()
@@ -72,25 +60,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("SELECT id FROM users WHERE email = %s", (email,))
-                if cur.fetchone():
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                        'body': json.dumps({'error': 'Пользователь с таким email уже существует'}),
-                        'isBase64Encoded': False
-                    }
-                
                 password_hash = hash_password(password)
                 
+                # Проверка занятости email и вставка - одна инструкция без гонки между ними
                 cur.execute(
-                    "INSERT INTO users (email, password_hash, name, role) VALUES (%s, %s, %s, %s) RETURNING id, email, name, role",
+                    """
+                    INSERT INTO users (email, password_hash, name, role) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (email) DO NOTHING
+                    RETURNING id, email, name, role
+                    """,
                     (email, password_hash, name or email.split('@')[0], 'user')
                 )
                 user = cur.fetchone()
                 conn.commit()
                 
-                token = generate_token()
+                if not user:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Пользователь с таким email уже существует'}),
+                        'isBase64Encoded': False
+                    }
+                
+                token = generate_token(user)
                 
                 return {
                     'statusCode': 201,
@@ -109,6 +101,28 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            elif action == 'logout':
+                token = get_token(event.get('headers') or {})
+                claims = verify_token(token) if token else None
+                
+                if not claims:
+                    return {
+                        'statusCode': 401,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Недействительный токен'}),
+                        'isBase64Encoded': False
+                    }
+                
+                revoke_token(cur, claims)
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'success': True, 'message': 'Выход выполнен'}),
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'login':
                 email = body_data.get('email', '').strip().lower()
                 password = body_data.get('password', '')
@@ -121,15 +135,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                password_hash = hash_password(password)
-                
+                # Сначала только чтение: неверный пароль не пишет в users и не берёт блокировку строки,
+                # а транзакция закрывается до scrypt, чтобы не держать снимок на время хеширования
                 cur.execute(
-                    "SELECT id, email, name, avatar_url, role FROM users WHERE email = %s AND password_hash = %s",
-                    (email, password_hash)
+                    "SELECT id, email, name, avatar_url, role, password_hash FROM users WHERE email = %s",
+                    (email,)
                 )
                 user = cur.fetchone()
+                conn.commit()
                 
-                if not user:
+                if user:
+                    valid, needs_rehash = verify_password(password, user['password_hash'])
+                else:
+                    burn_verify(password)
+                    valid, needs_rehash = False, False
+                
+                if not valid:
                     return {
                         'statusCode': 401,
                         'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
@@ -137,13 +158,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
+                # Старый SHA-256 или слабый scrypt заменяется текущим хешем, пока пароль известен;
+                # last_login и пересчитанный хеш - одна запись только после успешной проверки
+                new_hash = hash_password(password) if needs_rehash else None
                 cur.execute(
-                    "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = %s",
-                    (user['id'],)
+                    "UPDATE users SET last_login = CURRENT_TIMESTAMP, password_hash = COALESCE(%s, password_hash) WHERE id = %s",
+                    (new_hash, user['id'])
                 )
                 conn.commit()
                 
-                token = generate_token()
+                token = generate_token(user)
                 
                 return {
                     'statusCode': 200,
@@ -214,57 +238,27 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                token_data = {
-                    'code': code,
-                    'client_id': client_id,
-                    'client_secret': client_secret,
-                    'redirect_uri': 'https://websynapse.ru/auth/google/callback',
-                    'grant_type': 'authorization_code'
-                }
-                
-                token_request = urllib.request.Request(
-                    'https://oauth2.googleapis.com/token',
-                    data=urlencode(token_data).encode(),
-                    headers={'Content-Type': 'application/x-www-form-urlencoded'}
-                )
-                
                 try:
-                    with urllib.request.urlopen(token_request) as response:
-                        token_response = json.loads(response.read().decode())
+                    profile = sign_in(code, client_id, client_secret, 'https://websynapse.ru/auth/google/callback')
+                    email = profile['email']
+                    name = profile['name']
+                    avatar_url = profile['picture']
+                    google_id = profile['sub']
                     
-                    access_token = token_response.get('access_token')
-                    
-                    userinfo_request = urllib.request.Request(
-                        'https://www.googleapis.com/oauth2/v2/userinfo',
-                        headers={'Authorization': f'Bearer {access_token}'}
+                    # Новый пользователь или вход существующего - одна инструкция, без гонки двух первых входов
+                    cur.execute(
+                        """
+                        INSERT INTO users (email, name, avatar_url, google_id, role) VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (email) DO UPDATE SET
+                            last_login = CURRENT_TIMESTAMP, google_id = EXCLUDED.google_id, avatar_url = EXCLUDED.avatar_url
+                        RETURNING id, email, name, avatar_url, role
+                        """,
+                        (email, name, avatar_url, google_id, 'user')
                     )
-                    
-                    with urllib.request.urlopen(userinfo_request) as response:
-                        user_info = json.loads(response.read().decode())
-                    
-                    email = user_info.get('email', '').strip().lower()
-                    name = user_info.get('name', '')
-                    avatar_url = user_info.get('picture', '')
-                    google_id = user_info.get('id', '')
-                    
-                    cur.execute("SELECT id, email, name, avatar_url, role FROM users WHERE email = %s", (email,))
                     user = cur.fetchone()
+                    conn.commit()
                     
-                    if user:
-                        cur.execute(
-                            "UPDATE users SET last_login = CURRENT_TIMESTAMP, google_id = %s, avatar_url = %s WHERE id = %s",
-                            (google_id, avatar_url, user['id'])
-                        )
-                        conn.commit()
-                    else:
-                        cur.execute(
-                            "INSERT INTO users (email, name, avatar_url, google_id, role) VALUES (%s, %s, %s, %s, %s) RETURNING id, email, name, avatar_url, role",
-                            (email, name, avatar_url, google_id, 'user')
-                        )
-                        user = cur.fetchone()
-                        conn.commit()
-                    
-                    token = generate_token()
+                    token = generate_token(user)
                     
                     return {
                         'statusCode': 200,
@@ -293,7 +287,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'verify':
                 headers = event.get('headers') or {}
-                token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+                token = get_token(headers)
                 
                 if not token:
                     return {
@@ -303,7 +297,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                user_id = path_params.get('user_id')
+                # Старые случайные токены не проверяются; пока они в ходу, верим user_id из запроса
+                if is_signed(token) or not AUTH_ALLOW_USER_ID_HEADER:
+                    claims = verify_token(token)
+                    if not claims:
+                        return {
+                            'statusCode': 401,
+                            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                            'body': json.dumps({'error': 'Недействительный токен'}),
+                            'isBase64Encoded': False
+                        }
+                    user_id = claims['uid']
+                else:
+                    user_id = path_params.get('user_id')
+                
                 if not user_id:
                     return {
                         'statusCode': 400,
@@ -347,6 +354,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    except PasswordHasherBusy:
+        return {
+            'statusCode': 503,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json', 'Retry-After': '1'},
+            'body': json.dumps({'error': 'Сервис перегружен, повторите попытку'}),
+            'isBase64Encoded': False
+        }
     except Exception as e:
         return {
             'statusCode': 500,
@@ -358,4 +372,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
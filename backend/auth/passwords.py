@@ -0,0 +1,130 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', '50'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', '8'))
+PASSWORD_HASH_WAIT_SECONDS = float(os.environ.get('PASSWORD_HASH_WAIT_SECONDS', '2'))
+
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MIN_LOG2_N = 14
+SCRYPT_MAX_LOG2_N = 20
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class PasswordHasherBusy(Exception):
+    """Все воркеры заняты и очередь полна: запрос лучше повторить, чем ждать"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+def _scrypt(password: str, salt: bytes, log2_n: int, r: int, p: int) -> bytes:
+    n = 1 << log2_n
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=KEY_BYTES, maxmem=256 * n * r + 1024 * 1024
+    )
+
+
+_tuned_log2_n: Optional[int] = None
+_tune_lock = threading.Lock()
+
+
+def tuned_log2_n() -> int:
+    """
+    log2(N) для scrypt под PASSWORD_HASH_TARGET_MS на этом инстансе. Время scrypt
+    линейно по N, поэтому хватает замера на малом N; подбор один раз на процесс,
+    при первом хешировании. PASSWORD_SCRYPT_LOG2_N задаёт значение вручную.
+    """
+    global _tuned_log2_n
+    if _tuned_log2_n is not None:
+        return _tuned_log2_n
+    with _tune_lock:
+        if _tuned_log2_n is None:
+            fixed = os.environ.get('PASSWORD_SCRYPT_LOG2_N')
+            if fixed:
+                _tuned_log2_n = int(fixed)
+            else:
+                probe = 12
+                elapsed = min(_timed(probe) for _ in range(2))
+                per_n_ms = elapsed * 1000 / (1 << probe)
+                log2_n = SCRYPT_MIN_LOG2_N
+                while log2_n < SCRYPT_MAX_LOG2_N and per_n_ms * (1 << (log2_n + 1)) <= PASSWORD_HASH_TARGET_MS:
+                    log2_n += 1
+                _tuned_log2_n = log2_n
+    return _tuned_log2_n
+
+
+def _timed(log2_n: int) -> float:
+    started = time.perf_counter()
+    _scrypt('calibration', b'\0' * SALT_BYTES, log2_n, SCRYPT_R, SCRYPT_P)
+    return time.perf_counter() - started
+
+
+# hashlib.scrypt отпускает GIL, поэтому пул потоков действительно ограничивает число
+# одновременных хеширований; семафор ограничивает ещё и очередь к нему
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='kdf')
+_slots = threading.BoundedSemaphore(PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE)
+
+
+def _run(password: str, salt: bytes, log2_n: int, r: int, p: int) -> bytes:
+    if not _slots.acquire(timeout=PASSWORD_HASH_WAIT_SECONDS):
+        raise PasswordHasherBusy()
+    try:
+        return _executor.submit(_scrypt, password, salt, log2_n, r, p).result()
+    finally:
+        _slots.release()
+
+
+def hash_password(password: str) -> str:
+    """Хеш в формате scrypt$<log2 N>$<r>$<p>$<соль>$<ключ>: параметры хранятся рядом с хешем"""
+    log2_n = tuned_log2_n()
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _run(password, salt, log2_n, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${log2_n}${SCRYPT_R}${SCRYPT_P}${_b64encode(salt)}${_b64encode(key)}"
+
+
+def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, bool]:
+    """
+    (пароль верен, хеш пора пересчитать). Пересчёт нужен старым SHA-256 хешам
+    и scrypt-хешам с N ниже текущего подобранного.
+    """
+    if not stored:
+        return False, False
+    if stored.startswith('scrypt$'):
+        try:
+            _, log2_n, r, p, salt, key = stored.split('$')
+            expected = _b64decode(key)
+            actual = _run(password, _b64decode(salt), int(log2_n), int(r), int(p))
+        except ValueError:
+            return False, False
+        ok = hmac.compare_digest(actual, expected)
+        return ok, ok and int(log2_n) < tuned_log2_n()
+    # Устаревший формат: SHA-256 без соли
+    ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    return ok, ok
+
+
+_dummy_hash: Optional[str] = None
+
+
+def burn_verify(password: str) -> None:
+    """Проверка против фиктивного хеша, чтобы неизвестный email отвечал так же долго, как неверный пароль"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_urlsafe(16))
+    verify_password(password, _dummy_hash)
@@ -0,0 +1,237 @@
+"""
+Тесты проверки id_token: python -m unittest test_google_oauth
+JWKS и token endpoint Google подменяются локальным HTTP-стабом, RSA-ключи
+генерируются в тесте, поэтому сеть и сторонние пакеты не нужны.
+"""
+import base64
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _is_probable_prime(n, rounds=32):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d, r = d // 2, r + 1
+    for _ in range(rounds):
+        x = pow(secrets.randbelow(n - 3) + 2, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _prime(bits):
+    while True:
+        candidate = secrets.randbits(bits) | (1 << (bits - 1)) | (1 << (bits - 2)) | 1
+        if _is_probable_prime(candidate):
+            return candidate
+
+
+def generate_rsa_key(bits=2048, e=65537):
+    while True:
+        p, q = _prime(bits // 2), _prime(bits // 2)
+        phi = (p - 1) * (q - 1)
+        if p != q and phi % e:
+            return p * q, e, pow(e, -1, phi)
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def sign(claims, key, kid):
+    n, _, d = key
+    header = b64(json.dumps({'alg': 'RS256', 'kid': kid}).encode())
+    payload = b64(json.dumps(claims).encode())
+    k = (n.bit_length() + 7) // 8
+    t = bytes.fromhex('3031300d060960864801650304020105000420') + hashlib.sha256(f"{header}.{payload}".encode()).digest()
+    em = b'\x00\x01' + b'\xff' * (k - len(t) - 3) + b'\x00' + t
+    signature = pow(int.from_bytes(em, 'big'), d, n).to_bytes(k, 'big')
+    return f"{header}.{payload}.{b64(signature)}"
+
+
+def jwk(key, kid):
+    n, e, _ = key
+    return {'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': kid,
+            'n': b64(n.to_bytes((n.bit_length() + 7) // 8, 'big')), 'e': b64(e.to_bytes(3, 'big'))}
+
+
+class GoogleStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    keys = {}
+    id_token = ''
+    certs_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        GoogleStub.certs_requests += 1
+        self._send({'keys': list(GoogleStub.keys.values())}, {'Cache-Control': 'public, max-age=3600'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._send({'access_token': 'access', 'id_token': GoogleStub.id_token})
+
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), GoogleStub)
+base_url = f"http://127.0.0.1:{server.server_address[1]}"
+os.environ['GOOGLE_CERTS_URL'] = f"{base_url}/certs"
+os.environ['GOOGLE_TOKEN_URL'] = f"{base_url}/token"
+
+import google_oauth
+from google_oauth import GoogleAuthError
+
+CLIENT_ID = 'client-id.apps.googleusercontent.com'
+KEY = generate_rsa_key()
+ROTATED_KEY = generate_rsa_key()
+
+
+def claims(**overrides):
+    return {
+        'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': '1234567890',
+        'email': 'User@Example.com', 'email_verified': True, 'name': 'User', 'picture': 'https://example.com/p.png',
+        'iat': int(time.time()), 'exp': int(time.time()) + 3600, **overrides
+    }
+
+
+def setUpModule():
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def tearDownModule():
+    server.shutdown()
+
+
+class VerifyIdTokenTest(unittest.TestCase):
+    def setUp(self):
+        GoogleStub.keys = {'key-1': jwk(KEY, 'key-1')}
+        GoogleStub.certs_requests = 0
+        google_oauth.jwks = google_oauth.JwksCache(os.environ['GOOGLE_CERTS_URL'])
+
+    def assertRejected(self, token, message):
+        with self.assertRaises(GoogleAuthError) as raised:
+            google_oauth.verify_id_token(token, CLIENT_ID)
+        self.assertIn(message, str(raised.exception))
+
+    def test_valid_token(self):
+        verified = google_oauth.verify_id_token(sign(claims(), KEY, 'key-1'), CLIENT_ID)
+        self.assertEqual(verified['sub'], '1234567890')
+        self.assertEqual(GoogleStub.certs_requests, 1)
+
+    def test_keys_are_cached(self):
+        for _ in range(3):
+            google_oauth.verify_id_token(sign(claims(), KEY, 'key-1'), CLIENT_ID)
+        self.assertEqual(GoogleStub.certs_requests, 1)
+
+    def test_issuer_without_scheme_is_accepted(self):
+        google_oauth.verify_id_token(sign(claims(iss='accounts.google.com'), KEY, 'key-1'), CLIENT_ID)
+
+    def test_wrong_audience(self):
+        self.assertRejected(sign(claims(aud='other-client'), KEY, 'key-1'), 'not issued for this client')
+
+    def test_wrong_issuer(self):
+        self.assertRejected(sign(claims(iss='https://evil.example.com'), KEY, 'key-1'), 'not issued for this client')
+
+    def test_expired(self):
+        expired = int(time.time()) - google_oauth.CLOCK_SKEW_SECONDS - 10
+        self.assertRejected(sign(claims(exp=expired), KEY, 'key-1'), 'expired')
+
+    def test_expiry_within_clock_skew(self):
+        google_oauth.verify_id_token(sign(claims(exp=int(time.time()) - 5), KEY, 'key-1'), CLIENT_ID)
+
+    def test_bad_signature(self):
+        header, payload, signature = sign(claims(), KEY, 'key-1').split('.')
+        raw = bytearray(base64.urlsafe_b64decode(signature + '=' * (-len(signature) % 4)))
+        raw[-1] ^= 1
+        self.assertRejected(f"{header}.{payload}.{b64(bytes(raw))}", 'signature')
+
+    def test_tampered_claims(self):
+        header, _, signature = sign(claims(), KEY, 'key-1').split('.')
+        payload = b64(json.dumps(claims(email='attacker@example.com')).encode())
+        self.assertRejected(f"{header}.{payload}.{signature}", 'signature')
+
+    def test_signed_by_unknown_key(self):
+        self.assertRejected(sign(claims(), ROTATED_KEY, 'key-1'), 'signature')
+
+    def test_unexpected_algorithm(self):
+        header = b64(json.dumps({'alg': 'none', 'kid': 'key-1'}).encode())
+        payload = b64(json.dumps(claims()).encode())
+        self.assertRejected(f"{header}.{payload}.", 'algorithm')
+
+    def test_malformed_token(self):
+        self.assertRejected('not-a-jwt', 'Malformed')
+
+    def test_unknown_kid_refetches_rotated_keys(self):
+        google_oauth.verify_id_token(sign(claims(), KEY, 'key-1'), CLIENT_ID)
+        GoogleStub.keys = {'key-2': jwk(ROTATED_KEY, 'key-2')}
+        google_oauth.jwks._fetched_at -= google_oauth.JWKS_MIN_REFETCH_SECONDS + 1
+        verified = google_oauth.verify_id_token(sign(claims(), ROTATED_KEY, 'key-2'), CLIENT_ID)
+        self.assertEqual(verified['sub'], '1234567890')
+        self.assertEqual(GoogleStub.certs_requests, 2)
+
+    def test_unknown_kid_refetch_is_throttled(self):
+        google_oauth.verify_id_token(sign(claims(), KEY, 'key-1'), CLIENT_ID)
+        for _ in range(3):
+            self.assertRejected(sign(claims(), ROTATED_KEY, 'key-unknown'), 'signature')
+        self.assertEqual(GoogleStub.certs_requests, 1)
+
+
+class SignInTest(unittest.TestCase):
+    def setUp(self):
+        GoogleStub.keys = {'key-1': jwk(KEY, 'key-1')}
+        google_oauth.jwks = google_oauth.JwksCache(os.environ['GOOGLE_CERTS_URL'])
+
+    def sign_in(self, **overrides):
+        token_claims = claims(**overrides)
+        for name in [name for name, value in overrides.items() if value is None]:
+            del token_claims[name]
+        GoogleStub.id_token = sign(token_claims, KEY, 'key-1')
+        return google_oauth.sign_in('code', CLIENT_ID, 'secret', 'https://example.com/callback')
+
+    def test_profile_from_verified_token(self):
+        self.assertEqual(self.sign_in(), {
+            'email': 'user@example.com', 'name': 'User', 'picture': 'https://example.com/p.png', 'sub': '1234567890'
+        })
+
+    def test_string_email_verified(self):
+        self.assertEqual(self.sign_in(email_verified='true')['email'], 'user@example.com')
+
+    def test_unverified_email(self):
+        for value in (False, 'false'):
+            with self.assertRaises(GoogleAuthError):
+                self.sign_in(email_verified=value)
+
+    def test_missing_email_verified_is_unverified(self):
+        with self.assertRaises(GoogleAuthError):
+            self.sign_in(email_verified=None)
+
+
+if __name__ == '__main__':
+    unittest.main()
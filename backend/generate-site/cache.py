@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional
+
+import psycopg2
+
+from db import transaction
+from postprocess import compress, decompress
+
+CACHE_TTL_SECONDS = int(os.environ.get('GENERATION_CACHE_TTL', str(7 * 24 * 3600)))
+CACHE_MAX_ROWS = int(os.environ.get('GENERATION_CACHE_MAX_ROWS', '20000'))
+LOCAL_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_LOCAL_SIZE', '256'))
+PURGE_PROBABILITY = 0.02
+
+CACHE_MODES = ('bypass', 'prefer', 'only')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Приведение промпта к каноническому виду: регистр, пробелы, пунктуация"""
+    text = unicodedata.normalize('NFKC', prompt).lower().replace('ё', 'е')
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def make_cache_key(prompt: str, provider: str, model: str, system_prompt: str) -> str:
+    """Адрес результата генерации: нормализованный промпт + провайдер + модель + хеш системного промпта"""
+    system_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+    payload = json.dumps([normalize_prompt(prompt), provider, model, system_hash], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LocalLRU:
+    """LRU-кеш в памяти процесса с TTL, переживает тёплые вызовы функции"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, stored_at = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+_local_cache = LocalLRU(LOCAL_CACHE_SIZE, CACHE_TTL_SECONDS)
+
+
+def _db_enabled() -> bool:
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+def get_cached(key: str) -> Optional[str]:
+    """Поиск готового кода: сначала LRU процесса, затем таблица generation_cache"""
+    code = _local_cache.get(key)
+    if code is not None or not _db_enabled():
+        return code
+
+    try:
+        with transaction() as cur:
+            cur.execute(
+                """
+                UPDATE generation_cache
+                SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+                WHERE cache_key = %s AND created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                RETURNING code, code_compressed, content_encoding
+                """,
+                (key, CACHE_TTL_SECONDS)
+            )
+            row = cur.fetchone()
+    except Exception:
+        return None
+
+    if not row:
+        return None
+    code = row['code']
+    if code is None:
+        try:
+            code = decompress(row['content_encoding'], bytes(row['code_compressed']))
+        except Exception:
+            # Например, запись в brotli, а в этом окружении модуля brotli нет
+            return None
+    _local_cache.set(key, code)
+    return code
+
+
+def store_cached(key: str, provider: str, model: str, code: str) -> None:
+    """
+    Сохранение результата генерации; крупный код хранится сжатым (gzip/brotli).
+    Ошибки кеша не должны ломать генерацию
+    """
+    _local_cache.set(key, code)
+    if not _db_enabled():
+        return
+
+    try:
+        encoding, packed = compress(code)
+        with transaction() as cur:
+            cur.execute(
+                """
+                INSERT INTO generation_cache (cache_key, provider, model, code, code_compressed, content_encoding, size_bytes)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (cache_key) DO UPDATE
+                SET code = EXCLUDED.code, code_compressed = EXCLUDED.code_compressed,
+                    content_encoding = EXCLUDED.content_encoding, size_bytes = EXCLUDED.size_bytes,
+                    created_at = CURRENT_TIMESTAMP
+                """,
+                (
+                    key, provider, model,
+                    None if encoding else code,
+                    psycopg2.Binary(packed) if encoding else None,
+                    encoding,
+                    len(code.encode())
+                )
+            )
+            if random.random() < PURGE_PROBABILITY:
+                purge_expired(cur)
+    except Exception:
+        pass
+
+
+def purge_expired(cur: Any) -> None:
+    """Вытеснение устаревших записей и записей сверх лимита (по давности последнего попадания)"""
+    cur.execute(
+        "DELETE FROM generation_cache WHERE created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)",
+        (CACHE_TTL_SECONDS,)
+    )
+    cur.execute(
+        """
+        DELETE FROM generation_cache
+        WHERE cache_key IN (
+            SELECT cache_key FROM generation_cache
+            ORDER BY last_hit_at DESC
+            OFFSET %s
+        )
+        """,
+        (CACHE_MAX_ROWS,)
+    )
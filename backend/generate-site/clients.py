@@ -0,0 +1,82 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from openai import DefaultHttpxClient, OpenAI
+
+CLIENT_MAX_AGE_SECONDS = float(os.environ.get('LLM_CLIENT_MAX_AGE', '900'))
+CLIENT_MAX_ERRORS = int(os.environ.get('LLM_CLIENT_MAX_ERRORS', '3'))
+REQUEST_TIMEOUT_SECONDS = float(os.environ.get('LLM_REQUEST_TIMEOUT', '120'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('LLM_CONNECT_TIMEOUT', '5'))
+MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+POOL_MAX_CONNECTIONS = int(os.environ.get('LLM_POOL_MAX_CONNECTIONS', '20'))
+POOL_KEEPALIVE_SECONDS = float(os.environ.get('LLM_POOL_KEEPALIVE', '60'))
+
+
+class _ClientEntry:
+    def __init__(self, client: OpenAI):
+        self.client = client
+        self.created_at = time.monotonic()
+        self.consecutive_errors = 0
+
+
+_registry: Dict[Tuple[str, str, str], _ClientEntry] = {}
+_registry_lock = threading.Lock()
+
+
+def _registry_key(provider: str, base_url: Optional[str], api_key: str) -> Tuple[str, str, str]:
+    return provider, base_url or '', hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def _build_client(api_key: str, base_url: Optional[str]) -> OpenAI:
+    """Клиент с keep-alive пулом соединений, таймаутами и бюджетом повторов"""
+    timeout = httpx.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS)
+    http_client = DefaultHttpxClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=POOL_MAX_CONNECTIONS,
+            keepalive_expiry=POOL_KEEPALIVE_SECONDS
+        )
+    )
+    client_args: Dict[str, Any] = {
+        'api_key': api_key,
+        'timeout': timeout,
+        'max_retries': MAX_RETRIES,
+        'http_client': http_client
+    }
+    if base_url:
+        client_args['base_url'] = base_url
+    return OpenAI(**client_args)
+
+
+def get_client(provider: str, api_key: str, base_url: Optional[str]) -> OpenAI:
+    """
+    Клиент провайдера из реестра уровня модуля: тёплый контейнер переиспользует
+    TLS-соединения. Клиент пересоздаётся по возрасту или после серии ошибок.
+    """
+    key = _registry_key(provider, base_url, api_key)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is not None and (
+            time.monotonic() - entry.created_at > CLIENT_MAX_AGE_SECONDS
+            or entry.consecutive_errors >= CLIENT_MAX_ERRORS
+        ):
+            # Старый клиент не закрываем явно: им может пользоваться параллельный запрос
+            entry = None
+        if entry is None:
+            entry = _ClientEntry(_build_client(api_key, base_url))
+            _registry[key] = entry
+    return entry.client
+
+
+def report_result(provider: str, api_key: str, base_url: Optional[str], ok: bool) -> None:
+    """Учёт здоровья клиента: подряд идущие ошибки приводят к пересозданию пула"""
+    with _registry_lock:
+        entry = _registry.get(_registry_key(provider, base_url, api_key))
+        if entry is None:
+            return
+        entry.consecutive_errors = 0 if ok else entry.consecutive_errors + 1
@@ -0,0 +1,261 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+EDIT_CONTEXT_CHARS = 6000
+
+EDIT_SYSTEM_PROMPT = """Ты - эксперт по веб-разработке. Тебе дают оглавление HTML-документа, разбитого на секции с идентификаторами, полный текст нескольких секций и инструкцию пользователя.
+
+Измени только то, что требуется инструкцией. Ответ - только патч в формате:
+
+<<<REPLACE id>>>
+новый полный HTML секции
+<<<END>>>
+
+<<<INSERT_AFTER id>>>
+HTML новой секции
+<<<END>>>
+
+<<<DELETE id>>>
+
+Можно несколько операций. Не повторяй неизменённые секции, не добавляй объяснений."""
+
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr'
+}
+
+# Открывающий тег неявно закрывает стоящие на вершине стека элементы с необязательным закрывающим тегом
+IMPLIED_END = {
+    'li': {'li', 'p'},
+    'dt': {'dt', 'dd', 'p'},
+    'dd': {'dt', 'dd', 'p'},
+    'option': {'option'},
+    'optgroup': {'optgroup', 'option'},
+    'tr': {'tr', 'td', 'th'},
+    'td': {'td', 'th'},
+    'th': {'td', 'th'},
+    'thead': {'thead', 'tbody', 'tr', 'td', 'th'},
+    'tbody': {'thead', 'tbody', 'tr', 'td', 'th'},
+    'tfoot': {'thead', 'tbody', 'tr', 'td', 'th'}
+}
+P_CLOSING_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl', 'fieldset', 'figure', 'footer',
+    'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'main', 'nav', 'ol', 'p', 'pre',
+    'section', 'table', 'ul'
+}
+
+_OPAQUE_RE = re.compile(r'<(script|style)\b[^>]*>.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<!--.*?-->|<(/?)([a-zA-Z][\w-]*)\b[^>]*?(/?)>', re.DOTALL)
+_HEAD_RE = re.compile(r'<head\b[^>]*>(.*?)</head\s*>', re.IGNORECASE | re.DOTALL)
+_BODY_RE = re.compile(r'<body\b[^>]*>(.*)</body\s*>', re.IGNORECASE | re.DOTALL)
+_PATCH_RE = re.compile(
+    r'<<<(REPLACE|INSERT_AFTER)\s+([\w-]+)>>>\n?(.*?)\n?<<<END>>>|<<<DELETE\s+([\w-]+)>>>',
+    re.DOTALL
+)
+_WORD_RE = re.compile(r'[\wё]{3,}', re.IGNORECASE)
+
+STYLE_HINTS = ('цвет', 'стил', 'шрифт', 'фон', 'отступ', 'размер', 'color', 'style', 'font', 'css', 'тем')
+SCRIPT_HINTS = ('скрипт', 'анимац', 'клик', 'кноп', 'интерактив', 'script', 'click', 'js', 'javascript')
+
+
+class Segment(NamedTuple):
+    id: Optional[str]
+    text: str
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _opaque_spans(code: str, start: int, end: int) -> List[Tuple[int, int, str]]:
+    return [(m.start(), m.end(), m.group(1).lower()) for m in _OPAQUE_RE.finditer(code, start, end)]
+
+
+def _split_head(code: str, start: int, end: int, counters: Dict[str, int], out: List[Tuple[int, int, str]]) -> None:
+    cursor = start
+    for span_start, span_end, kind in _opaque_spans(code, start, end):
+        if code[cursor:span_start].strip():
+            out.append((cursor, span_start, _next_id('head', counters)))
+        out.append((span_start, span_end, _next_id(kind, counters)))
+        cursor = span_end
+    if code[cursor:end].strip():
+        out.append((cursor, end, _next_id('head', counters)))
+
+
+def _close_implied(stack: List[str], name: str) -> None:
+    closes = IMPLIED_END.get(name, set()) | ({'p'} if name in P_CLOSING_TAGS else set())
+    while stack and stack[-1] in closes:
+        stack.pop()
+
+
+def _split_body(code: str, start: int, end: int, counters: Dict[str, int], out: List[Tuple[int, int, str]]) -> None:
+    """
+    Верхнеуровневые элементы body; script/style внутри элементов остаются частью элемента.
+    Открытые элементы хранятся стеком: закрывающий тег снимает всё до своей пары,
+    поэтому незакрытые li, p, td и option не сдвигают границы секций.
+    """
+    opaque = {s: (e, kind) for s, e, kind in _opaque_spans(code, start, end)}
+    stack: List[str] = []
+    element_start = None
+    pos = start
+    while pos < end:
+        if pos in opaque:
+            span_end, kind = opaque[pos]
+            if not stack:
+                out.append((pos, span_end, _next_id(kind, counters)))
+            pos = span_end
+            continue
+        match = _TAG_RE.search(code, pos, end)
+        if not match:
+            break
+        next_opaque = min((s for s in opaque if s >= pos), default=None)
+        if next_opaque is not None and next_opaque <= match.start():
+            pos = next_opaque
+            continue
+        closing, name, self_closing = match.group(1), match.group(2), match.group(3)
+        if name is None:
+            pos = match.end()
+            continue
+        name = name.lower()
+        if closing:
+            if name in stack:
+                del stack[len(stack) - 1 - stack[::-1].index(name):]
+                if not stack and element_start is not None:
+                    out.append((element_start, match.end(), _next_id('section', counters)))
+                    element_start = None
+        else:
+            _close_implied(stack, name)
+            if not stack and element_start is not None:
+                # Верхнеуровневый элемент без закрывающего тега заканчивается перед следующим
+                out.append((element_start, match.start(), _next_id('section', counters)))
+                element_start = None
+            if name in VOID_TAGS or self_closing:
+                if not stack:
+                    out.append((match.start(), match.end(), _next_id('section', counters)))
+            else:
+                if not stack:
+                    element_start = match.start()
+                stack.append(name)
+        pos = match.end()
+    if element_start is not None:
+        out.append((element_start, end, _next_id('section', counters)))
+
+
+def _next_id(kind: str, counters: Dict[str, int]) -> str:
+    counters[kind] = counters.get(kind, 0) + 1
+    return f"{kind}-{counters[kind]}"
+
+
+def segment_html(code: str) -> List[Segment]:
+    """
+    Разбиение документа на адресуемые секции (head-N, style-N, script-N, section-N)
+    и неадресуемые связки между ними. Конкатенация сегментов даёт исходный код.
+    """
+    counters: Dict[str, int] = {}
+    spans: List[Tuple[int, int, str]] = []
+    head = _HEAD_RE.search(code)
+    if head:
+        _split_head(code, head.start(1), head.end(1), counters, spans)
+    body = _BODY_RE.search(code)
+    if body:
+        _split_body(code, body.start(1), body.end(1), counters, spans)
+    else:
+        _split_body(code, head.end() if head else 0, len(code), counters, spans)
+
+    segments: List[Segment] = []
+    cursor = 0
+    for start, end, section_id in sorted(spans):
+        if start > cursor:
+            segments.append(Segment(None, code[cursor:start]))
+        segments.append(Segment(section_id, code[start:end]))
+        cursor = end
+    if cursor < len(code):
+        segments.append(Segment(None, code[cursor:]))
+    return segments
+
+
+def _summary(text: str) -> str:
+    opening = text[:text.find('>') + 1] if '>' in text else text[:80]
+    plain = re.sub(r'<[^>]+>', ' ', _OPAQUE_RE.sub(' ', text))
+    plain = ' '.join(plain.split())[:60]
+    return f"{opening[:80]} {plain}".strip()
+
+
+def select_sections(segments: List[Segment], instruction: str, budget: int = EDIT_CONTEXT_CHARS) -> List[Segment]:
+    """Секции, относящиеся к инструкции: пересечение слов, подсказки про стили/скрипты, лимит по объёму"""
+    words = {w.lower() for w in _WORD_RE.findall(instruction)}
+    lowered = instruction.lower()
+    wants_style = any(hint in lowered for hint in STYLE_HINTS)
+    wants_script = any(hint in lowered for hint in SCRIPT_HINTS)
+
+    scored = []
+    for index, segment in enumerate(segments):
+        if segment.id is None:
+            continue
+        text = segment.text.lower()
+        score = sum(1 for w in words if w in text)
+        if wants_style and segment.id.startswith('style'):
+            score += 2
+        if wants_script and segment.id.startswith('script'):
+            score += 2
+        if score:
+            scored.append((score, index, segment))
+
+    if not scored:
+        # Ничего не совпало: отдаём первые секции body, обычно правки касаются hero-блока
+        scored = [(0, i, s) for i, s in enumerate(segments) if s.id and s.id.startswith('section')][:2]
+
+    chosen, used = [], 0
+    for _, index, segment in sorted(scored, key=lambda item: (-item[0], item[1])):
+        if chosen and used + len(segment.text) > budget:
+            continue
+        chosen.append((index, segment))
+        used += len(segment.text)
+    return [segment for _, segment in sorted(chosen, key=lambda item: item[0])]
+
+
+def build_edit_messages(segments: List[Segment], selected: List[Segment], instruction: str) -> List[Dict[str, str]]:
+    outline = '\n'.join(f"- {s.id}: {_summary(s.text)}" for s in segments if s.id)
+    sections = '\n\n'.join(f"=== {s.id} ===\n{s.text}" for s in selected)
+    return [
+        {"role": "system", "content": EDIT_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Оглавление документа:\n{outline}\n\nСекции:\n{sections}\n\nИнструкция: {instruction}"}
+    ]
+
+
+def parse_patch(text: str) -> List[Tuple[str, str, str]]:
+    operations = []
+    for match in _PATCH_RE.finditer(text):
+        if match.group(4):
+            operations.append(('DELETE', match.group(4), ''))
+        else:
+            operations.append((match.group(1), match.group(2), match.group(3)))
+    if not operations:
+        raise PatchError('Model response does not contain patch operations')
+    return operations
+
+
+def apply_patch(segments: List[Segment], operations: List[Tuple[str, str, str]]) -> Tuple[str, List[str]]:
+    """Применение патча к сегментам; возвращает новый документ и изменённые секции"""
+    by_id = {s.id: i for i, s in enumerate(segments) if s.id}
+    texts = [s.text for s in segments]
+    inserts: Dict[int, List[str]] = {}
+    changed = []
+    for op, section_id, html in operations:
+        if section_id not in by_id:
+            raise PatchError(f'Unknown section: {section_id}')
+        index = by_id[section_id]
+        if op == 'REPLACE':
+            texts[index] = html.strip()
+        elif op == 'DELETE':
+            texts[index] = ''
+        else:
+            inserts.setdefault(index, []).append(html.strip())
+        changed.append(section_id)
+
+    result = []
+    for index, text in enumerate(texts):
+        result.append(text)
+        for html in inserts.get(index, []):
+            result.append('\n' + html)
+    return ''.join(result), changed
@@ -0,0 +1,248 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from clients import report_result
+
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '0.9'))
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', '4'))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', '0.5'))
+HEDGE_MAX_DELAY = float(os.environ.get('HEDGE_MAX_DELAY', '15'))
+
+BREAKER_WINDOW = int(os.environ.get('BREAKER_WINDOW', '20'))
+BREAKER_MIN_SAMPLES = int(os.environ.get('BREAKER_MIN_SAMPLES', '5'))
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_SLOW_SECONDS = float(os.environ.get('BREAKER_SLOW_SECONDS', '20'))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', '30'))
+
+
+class Candidate(NamedTuple):
+    provider: str
+    model: str
+    client: Any
+    api_key: str
+    base_url: Optional[str]
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера: скользящее окно ошибок и задержек первого токена.
+    Открывается при высокой доле ошибок или медленной медиане, после паузы
+    пропускает одну пробную попытку (half-open).
+    """
+
+    def __init__(self):
+        self.outcomes: deque = deque(maxlen=BREAKER_WINDOW)
+        self.latencies: deque = deque(maxlen=BREAKER_WINDOW)
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < BREAKER_COOLDOWN or self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+
+    def record(self, ok: bool, first_token_latency: Optional[float] = None) -> None:
+        with self.lock:
+            if self.opened_at is not None and self.probe_in_flight:
+                self.probe_in_flight = False
+                if ok:
+                    self.opened_at = None
+                    self.outcomes.clear()
+                    self.latencies.clear()
+                else:
+                    self.opened_at = time.monotonic()
+                    return
+            self.outcomes.append(ok)
+            if first_token_latency is not None:
+                self.latencies.append(first_token_latency)
+            if self.opened_at is None and self._degraded():
+                self.opened_at = time.monotonic()
+
+    def _degraded(self) -> bool:
+        if len(self.outcomes) < BREAKER_MIN_SAMPLES:
+            return False
+        error_rate = self.outcomes.count(False) / len(self.outcomes)
+        if error_rate >= BREAKER_ERROR_RATE:
+            return True
+        return len(self.latencies) >= BREAKER_MIN_SAMPLES and percentile(self.latencies, 0.5) > BREAKER_SLOW_SECONDS
+
+    def hedge_delay(self) -> float:
+        """Дедлайн ожидания первого токена: заданный перцентиль истории задержек"""
+        with self.lock:
+            if len(self.latencies) < BREAKER_MIN_SAMPLES:
+                return HEDGE_DEFAULT_DELAY
+            value = percentile(self.latencies, HEDGE_PERCENTILE)
+        return min(max(value, HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+
+def percentile(values: Any, fraction: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker()
+        return _breakers[provider]
+
+
+class _Attempt:
+    def __init__(self, candidate: Candidate, messages: List[Dict[str, str]], events: 'queue.Queue'):
+        self.candidate = candidate
+        self.messages = messages
+        self.events = events
+        self.cancelled = threading.Event()
+        self.stream: Any = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> '_Attempt':
+        self.thread.start()
+        return self
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        stream = self.stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+    def _run(self) -> None:
+        candidate = self.candidate
+        breaker = get_breaker(candidate.provider)
+        started = time.monotonic()
+        first_token_latency = None
+        try:
+            stream = self.stream = candidate.client.chat.completions.create(
+                model=candidate.model,
+                messages=self.messages,
+                temperature=0.8,
+                max_tokens=4000,
+                stream=True
+            )
+            try:
+                for chunk in stream:
+                    if self.cancelled.is_set():
+                        break
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token_latency is None:
+                            first_token_latency = time.monotonic() - started
+                        self.events.put(('token', self, delta))
+            finally:
+                stream.close()
+        except Exception as e:
+            if self.cancelled.is_set():
+                self._record_cancelled(breaker, started, first_token_latency)
+            else:
+                breaker.record(False)
+                report_result(candidate.provider, candidate.api_key, candidate.base_url, False)
+            self.events.put(('error', self, e))
+            return
+        if self.cancelled.is_set():
+            self._record_cancelled(breaker, started, first_token_latency)
+        else:
+            breaker.record(True, first_token_latency)
+            report_result(candidate.provider, candidate.api_key, candidate.base_url, True)
+        self.events.put(('done', self, None))
+
+    @staticmethod
+    def _record_cancelled(breaker: CircuitBreaker, started: float, first_token_latency: Optional[float]) -> None:
+        # Проигравший не дождался первого токена: прошедшее время - нижняя оценка его задержки
+        breaker.record(True, first_token_latency if first_token_latency is not None else time.monotonic() - started)
+
+
+class HedgedGeneration:
+    """
+    Хеджированная генерация: запрос уходит основному провайдеру; если первый
+    токен не пришёл к дедлайну, тот же запрос уходит запасному. Побеждает тот,
+    кто ответил первым, проигравший поток закрывается.
+    """
+
+    def __init__(self, candidates: List[Candidate], messages: List[Dict[str, str]]):
+        self.candidates = candidates
+        self.messages = messages
+        self.provider: Optional[str] = None
+        self.model: Optional[str] = None
+        self.hedged = False
+
+    def _start_next(self, pending: List[Candidate], events: 'queue.Queue', force: bool) -> Optional[_Attempt]:
+        """Запуск следующего кандидата, чей предохранитель пропускает запрос"""
+        while pending:
+            candidate = pending.pop(0)
+            if get_breaker(candidate.provider).allow():
+                return _Attempt(candidate, self.messages, events).start()
+        if force:
+            # Все предохранители открыты: пробуем основного провайдера, а не отказываем вслепую
+            return _Attempt(self.candidates[0], self.messages, events).start()
+        return None
+
+    def __iter__(self) -> Iterator[str]:
+        events: 'queue.Queue' = queue.Queue()
+        pending = list(self.candidates)
+        active = [self._start_next(pending, events, force=True)]
+        deadline = time.monotonic() + get_breaker(active[0].candidate.provider).hedge_delay()
+        winner: Optional[_Attempt] = None
+
+        try:
+            while True:
+                timeout = None
+                if winner is None and pending:
+                    timeout = max(0.0, deadline - time.monotonic())
+                try:
+                    kind, attempt, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge = self._start_next(pending, events, force=False)
+                    if hedge is not None:
+                        active.append(hedge)
+                        self.hedged = True
+                    continue
+
+                if winner is None:
+                    if kind == 'error':
+                        active.remove(attempt)
+                        if not active:
+                            fallback = self._start_next(pending, events, force=False)
+                            if fallback is None:
+                                raise payload
+                            active.append(fallback)
+                            self.hedged = True
+                        continue
+                    winner = attempt
+                    self.provider = attempt.candidate.provider
+                    self.model = attempt.candidate.model
+                    for other in active:
+                        if other is not winner:
+                            other.cancel()
+                    pending = []
+
+                if attempt is not winner:
+                    continue
+                if kind == 'token':
+                    yield payload
+                elif kind == 'error':
+                    raise payload
+                else:
+                    return
+        finally:
+            for attempt in active:
+                if attempt is not winner:
+                    attempt.cancel()
@@ -1,6 +1,509 @@
+import base64
 import json
 import os
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from cache import CACHE_MODES, make_cache_key, get_cached, store_cached
+from clients import get_client, report_result
+from hedging import Candidate, HedgedGeneration
+from jobs import enqueue_job, get_job, run_worker
+from singleflight import coalesce
+from editing import PatchError, segment_html, select_sections, build_edit_messages, parse_patch, apply_patch
+from projects_api import load_project_code, save_project_code
+from ratelimit import acquire, release, get_subject, get_plan, plan_capacity
+from postprocess import COMPRESS_RESPONSES, compress, process_stream
+from session_tokens import authenticate, get_token, is_signed
+
+EDIT_MAX_TOKENS = int(os.environ.get('EDIT_MAX_TOKENS', '1500'))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', '10'))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '5'))
+
+SYSTEM_PROMPT = """Ты - эксперт по веб-разработке. Создай полноценный HTML-файл сайта на основе описания пользователя.
+
+Требования:
+1. Один самодостаточный HTML файл с встроенными <style> и <script>
+2. Современный дизайн с Tailwind CSS (через CDN)
+3. Адаптивная верстка
+4. Плавные анимации и hover-эффекты
+5. Чистый, читаемый код с комментариями
+6. Используй яркие цвета и градиенты где уместно
+7. Добавь интерактивность через JavaScript где нужно
+
+Верни только готовый HTML код без объяснений."""
+
+
+def get_provider_config(ai_provider: str) -> Tuple[Optional[str], Optional[str], str, Optional[str]]:
+    """Ключ, base_url, модель и текст ошибки для выбранного провайдера"""
+    if ai_provider == 'openai':
+        api_key = os.environ.get('OPENAI_API_KEY')
+        return api_key, None, 'gpt-4o-mini', None if api_key else 'OpenAI API key not configured'
+    api_key = os.environ.get('DEEPSEEK_API_KEY')
+    return api_key, os.environ.get('DEEPSEEK_BASE_URL', 'https://api.deepseek.com'), 'deepseek-chat', None if api_key else 'DeepSeek API key not configured'
+
+
+def build_messages(prompt: str) -> list:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Создай сайт: {prompt}"}
+    ]
+
+
+def stream_site_code(client: Any, model: str, prompt: str) -> Iterator[str]:
+    """Потоковая генерация: отдаёт обработанные куски HTML по мере прихода токенов"""
+    stream = client.chat.completions.create(
+        model=model,
+        messages=build_messages(prompt),
+        temperature=0.8,
+        max_tokens=4000,
+        stream=True
+    )
+
+    def deltas() -> Iterator[str]:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    return process_stream(deltas())
+
+
+def build_candidates(primary: str) -> List[Candidate]:
+    """Настроенные провайдеры для хеджирования: сначала основной, затем запасной"""
+    candidates = []
+    for provider in (primary, 'deepseek' if primary == 'openai' else 'openai'):
+        api_key, base_url, model, config_error = get_provider_config(provider)
+        if not config_error:
+            candidates.append(Candidate(provider, model, get_client(provider, api_key, base_url), api_key, base_url))
+    return candidates
+
+
+def generate_code(prompt: str, ai_provider: str, hedge_mode: bool = False) -> Tuple[str, str, str]:
+    """Генерация целиком: обработанный код, фактический провайдер и модель; результат кладётся в кеш"""
+    api_key, base_url, model, config_error = get_provider_config(ai_provider)
+    requested_key = make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT)
+    if hedge_mode:
+        candidates = build_candidates(ai_provider)
+        if not candidates:
+            raise RuntimeError(config_error)
+        generation = HedgedGeneration(candidates, build_messages(prompt))
+        code = ''.join(process_stream(generation))
+        ai_provider, model = generation.provider, generation.model
+    else:
+        if config_error:
+            raise RuntimeError(config_error)
+        client = get_client(ai_provider, api_key, base_url)
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=build_messages(prompt),
+                temperature=0.8,
+                max_tokens=4000
+            )
+        except Exception:
+            report_result(ai_provider, api_key, base_url, False)
+            raise
+        report_result(ai_provider, api_key, base_url, True)
+        code = ''.join(process_stream([response.choices[0].message.content or '']))
+    actual_key = make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT)
+    store_cached(actual_key, ai_provider, model, code)
+    if actual_key != requested_key:
+        # Хедж выиграл запасной провайдер: ожидающие по исходному ключу тоже должны увидеть результат
+        store_cached(requested_key, ai_provider, model, code)
+    return code, ai_provider, model
+
+
+def generate_code_coalesced(prompt: str, ai_provider: str, hedge_mode: bool = False) -> Tuple[str, str, str, bool]:
+    """generate_code с объединением одинаковых одновременных запросов"""
+    _, _, model, _ = get_provider_config(ai_provider)
+    key = make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT)
+    (code, provider, model), shared = coalesce(key, ai_provider, model, lambda: generate_code(prompt, ai_provider, hedge_mode))
+    return code, provider, model, shared
+
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ''
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def site_response(code: str, prompt: str, model: str, provider: str, cache_status: str, stream_mode: bool, accept_encoding: str = '') -> Dict[str, Any]:
+    """Ответ с готовым кодом: JSON или SSE (одним событием) для потокового режима; JSON сжимается, если клиент это принимает"""
+    meta = {'prompt': prompt, 'model': model, 'provider': provider, 'cache': cache_status}
+    if stream_mode:
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Content-Type': 'text/event-stream; charset=utf-8',
+                'Cache-Control': 'no-cache',
+                'X-Cache': cache_status
+            },
+            'body': sse_event({'delta': code}) + sse_event({'success': True, **meta}, 'done'),
+            'isBase64Encoded': False
+        }
+    body = json.dumps({'success': True, 'code': code, **meta})
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Content-Type': 'application/json',
+        'X-Cache': cache_status
+    }
+    encoding = None
+    if COMPRESS_RESPONSES and accept_encoding:
+        encoding, packed = compress(body, accept_encoding)
+    if encoding:
+        headers['Content-Encoding'] = encoding
+        headers['Vary'] = 'Accept-Encoding'
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': base64.b64encode(packed).decode(),
+            'isBase64Encoded': True
+        }
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def edit_project(body_data: Dict[str, Any], user_id: Optional[str]) -> Dict[str, Any]:
+    """
+    Точечная правка проекта: модель получает только относящиеся к инструкции
+    секции и возвращает патч, который применяется на сервере
+    """
+    project_id = body_data.get('projectId')
+    instruction = (body_data.get('instruction') or body_data.get('prompt') or '').strip()
+    ai_provider = body_data.get('aiProvider', 'deepseek')
+    
+    if not project_id or not instruction:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'projectId and instruction are required'}),
+            'isBase64Encoded': False
+        }
+    
+    current_code = load_project_code(project_id, user_id)
+    if current_code is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Project not found'}),
+            'isBase64Encoded': False
+        }
+    
+    api_key, base_url, model, config_error = get_provider_config(ai_provider)
+    if config_error:
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': config_error}),
+            'isBase64Encoded': False
+        }
+    
+    segments = segment_html(current_code)
+    selected = select_sections(segments, instruction)
+    client = get_client(ai_provider, api_key, base_url)
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=build_edit_messages(segments, selected, instruction),
+            temperature=0.3,
+            max_tokens=EDIT_MAX_TOKENS
+        )
+    except Exception:
+        report_result(ai_provider, api_key, base_url, False)
+        raise
+    report_result(ai_provider, api_key, base_url, True)
+    
+    try:
+        new_code, changed = apply_patch(segments, parse_patch(response.choices[0].message.content or ''))
+    except PatchError as e:
+        return {
+            'statusCode': 422,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    
+    save_project_code(project_id, user_id, instruction, new_code, f"Правка: {instruction[:200]}")
+    usage = getattr(response, 'usage', None)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+        'body': json.dumps({
+            'success': True,
+            'project_id': project_id,
+            'code': new_code,
+            'changed_sections': changed,
+            'model': model,
+            'provider': ai_provider,
+            'tokens': usage.total_tokens if usage else None
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def parse_variants(body_data: Dict[str, Any]) -> Optional[int]:
+    """Число вариантов из запроса или None, если это не целое число"""
+    value = body_data.get('variants', 1)
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_batch(body_data: Dict[str, Any]) -> bool:
+    return body_data.get('prompts') is not None or parse_variants(body_data) != 1
+
+
+def parse_batch(body_data: Dict[str, Any]) -> Tuple[List[Tuple[str, bool]], Optional[str]]:
+    """Элементы пакета (промпт, вариант ли это) или текст ошибки для ответа 400"""
+    prompts = body_data.get('prompts')
+    if prompts is not None:
+        if not isinstance(prompts, list) or not all(isinstance(p, str) and p.strip() for p in prompts):
+            return [], 'prompts must be a list of non-empty strings'
+        items = [(p.strip(), False) for p in prompts]
+    else:
+        variants = parse_variants(body_data)
+        prompt = body_data.get('prompt', '')
+        if variants is None:
+            return [], 'variants must be an integer'
+        if not isinstance(prompt, str) or not prompt.strip():
+            return [], 'Prompt is required'
+        items = [(prompt.strip(), True)] * max(0, min(variants, BATCH_MAX_ITEMS + 1))
+    if not items or len(items) > BATCH_MAX_ITEMS:
+        return [], f'Provide 1-{BATCH_MAX_ITEMS} non-empty prompts or variants'
+    return items, None
+
+
+def batch_generate(body_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Пакетная генерация: массив промптов или N вариантов одного промпта
+    выполняются параллельно; в потоковом режиме результаты отдаются по мере готовности
+    """
+    ai_provider = body_data.get('aiProvider', 'deepseek')
+    hedge_mode = bool(body_data.get('hedge', False))
+    stream_mode = bool(body_data.get('stream', False))
+    cache_mode = body_data.get('cache', 'prefer')
+    
+    items, error = parse_batch(body_data)
+    if not error and cache_mode not in CACHE_MODES:
+        error = 'cache must be one of: bypass, prefer, only'
+    if error:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': error}),
+            'isBase64Encoded': False
+        }
+    
+    def run_item(index: int, prompt: str, variant: bool) -> Dict[str, Any]:
+        try:
+            if variant:
+                # Варианты должны различаться, поэтому кеш и объединение запросов не используются
+                code, provider, model = generate_code(prompt, ai_provider, hedge_mode)
+                status = 'generated'
+            else:
+                _, _, model, _ = get_provider_config(ai_provider)
+                cached = get_cached(make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT)) if cache_mode != 'bypass' else None
+                if cached is not None:
+                    code, provider, status = cached, ai_provider, 'hit'
+                elif cache_mode == 'only':
+                    return {'index': index, 'prompt': prompt, 'success': False, 'error': 'Result not found in cache'}
+                else:
+                    code, provider, model, shared = generate_code_coalesced(prompt, ai_provider, hedge_mode)
+                    status = 'coalesced' if shared else 'generated'
+            return {'index': index, 'prompt': prompt, 'success': True, 'code': code, 'provider': provider, 'model': model, 'cache': status}
+        except Exception as e:
+            return {'index': index, 'prompt': prompt, 'success': False, 'error': str(e)}
+    
+    events = []
+    results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(items)))) as pool:
+        futures = [pool.submit(run_item, i, p, variant) for i, (p, variant) in enumerate(items)]
+        for future in as_completed(futures):
+            item = future.result()
+            results[item['index']] = item
+            events.append(sse_event(item, 'item'))
+    
+    summary = {
+        'success': True,
+        'total': len(results),
+        'succeeded': sum(1 for r in results if r['success']),
+        'failed': sum(1 for r in results if not r['success'])
+    }
+    
+    if stream_mode:
+        events.append(sse_event(summary, 'done'))
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Content-Type': 'text/event-stream; charset=utf-8',
+                'Cache-Control': 'no-cache'
+            },
+            'body': ''.join(events),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+        'body': json.dumps({**summary, 'results': results}),
+        'isBase64Encoded': False
+    }
+
+
+def validate_request(body_data: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+    """
+    Стоимость запроса в генерациях или текст ошибки для ответа 400.
+    Вызывается до списания лимита, чтобы некорректные запросы не тратили квоту.
+    """
+    if body_data.get('mode') == 'edit':
+        if not body_data.get('projectId') or not (body_data.get('instruction') or body_data.get('prompt') or '').strip():
+            return 0, 'projectId and instruction are required'
+        return 1, None
+    cost = 1
+    if is_batch(body_data):
+        items, error = parse_batch(body_data)
+        if error:
+            return 0, error
+        cost = len(items)
+    elif not body_data.get('prompt', '').strip():
+        return 0, 'Prompt is required'
+    if body_data.get('cache', 'prefer') not in CACHE_MODES:
+        return 0, 'cache must be one of: bypass, prefer, only'
+    return cost, None
+
+
+def cached_response(body_data: Dict[str, Any], accept_encoding: str = '') -> Optional[Dict[str, Any]]:
+    """
+    Ответ из кеша для одиночного запроса или None, если нужна генерация.
+    Попадание не обращается к модели и поэтому не списывает лимит.
+    """
+    cache_mode = body_data.get('cache', 'prefer')
+    if body_data.get('mode') == 'edit' or is_batch(body_data) or cache_mode == 'bypass':
+        return None
+    prompt = body_data.get('prompt', '').strip()
+    ai_provider = body_data.get('aiProvider', 'deepseek')
+    _, _, model, _ = get_provider_config(ai_provider)
+    cached_code = get_cached(make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT))
+    if cached_code is not None:
+        return site_response(cached_code, prompt, model, ai_provider, 'hit', bool(body_data.get('stream', False)), accept_encoding)
+    if cache_mode == 'only':
+        return {
+            'statusCode': 404,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json', 'X-Cache': 'miss'},
+            'body': json.dumps({'error': 'Result not found in cache', 'cache': 'miss'}),
+            'isBase64Encoded': False
+        }
+    return None
+
+
+def process_request(body_data: Dict[str, Any], user_id: Optional[str], accept_encoding: str = '') -> Dict[str, Any]:
+    """
+    Разбор режима запроса: правка, пакет, асинхронная задача, потоковая или обычная генерация.
+    Кеш одиночных запросов к этому моменту уже проверен в cached_response.
+    """
+    if body_data.get('mode') == 'edit':
+        return edit_project(body_data, user_id)
+    
+    if is_batch(body_data):
+        return batch_generate(body_data)
+    
+    prompt = body_data.get('prompt', '').strip()
+    ai_provider = body_data.get('aiProvider', 'deepseek')
+    stream_mode = bool(body_data.get('stream', False))
+    hedge_mode = bool(body_data.get('hedge', False))
+    cache_mode = body_data.get('cache', 'prefer')
+    async_mode = body_data.get('mode') == 'async'
+    
+    if not prompt:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'Prompt is required'}),
+            'isBase64Encoded': False
+        }
+    
+    if cache_mode not in CACHE_MODES:
+        return {
+            'statusCode': 400,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': 'cache must be one of: bypass, prefer, only'}),
+            'isBase64Encoded': False
+        }
+    
+    api_key, base_url, model, config_error = get_provider_config(ai_provider)
+    cache_status = 'miss' if cache_mode == 'prefer' else 'bypass'
+    
+    if async_mode:
+        job_id, access_key = enqueue_job(user_id, prompt, ai_provider, hedge_mode, body_data.get('projectId'))
+        job_body = {'success': True, 'job_id': job_id, 'status': 'queued'}
+        if access_key:
+            job_body['job_key'] = access_key
+        return {
+            'statusCode': 202,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps(job_body),
+            'isBase64Encoded': False
+        }
+    
+    candidates = build_candidates(ai_provider) if hedge_mode else []
+    if config_error and not candidates:
+        return {
+            'statusCode': 500,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': config_error}),
+            'isBase64Encoded': False
+        }
+    
+    if stream_mode:
+        generation = HedgedGeneration(candidates, build_messages(prompt)) if hedge_mode else None
+        client = None if hedge_mode else get_client(ai_provider, api_key, base_url)
+        events = []
+        pieces = []
+        try:
+            source = process_stream(generation) if generation else stream_site_code(client, model, prompt)
+            for piece in source:
+                pieces.append(piece)
+                events.append(sse_event({'delta': piece}))
+            if generation:
+                ai_provider, model = generation.provider, generation.model
+            else:
+                report_result(ai_provider, api_key, base_url, True)
+            events.append(sse_event({'success': True, 'prompt': prompt, 'model': model, 'provider': ai_provider, 'cache': cache_status}, 'done'))
+            store_cached(make_cache_key(prompt, ai_provider, model, SYSTEM_PROMPT), ai_provider, model, ''.join(pieces))
+        except Exception as stream_error:
+            if not generation:
+                report_result(ai_provider, api_key, base_url, False)
+            events.append(sse_event({'error': str(stream_error)}, 'error'))
+    
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Content-Type': 'text/event-stream; charset=utf-8',
+                'Cache-Control': 'no-cache',
+                'X-Cache': cache_status
+            },
+            'body': ''.join(events),
+            'isBase64Encoded': False
+        }
+    
+    if cache_mode == 'prefer':
+        generated_code, ai_provider, model, shared = generate_code_coalesced(prompt, ai_provider, hedge_mode)
+        if shared:
+            cache_status = 'coalesced'
+    else:
+        generated_code, ai_provider, model = generate_code(prompt, ai_provider, hedge_mode)
+    
+    return site_response(generated_code, prompt, model, ai_provider, cache_status, False, accept_encoding)
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -13,14 +516,49 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Authorization, X-Worker-Token',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    params = event.get('queryStringParameters') or {}
+    headers = event.get('headers') or {}
+    user_id, auth_error = authenticate(headers)
+    if auth_error:
+        return {
+            'statusCode': 401,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'error': auth_error}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'GET' and params.get('job_id'):
+        try:
+            job = get_job(params['job_id'], user_id, params.get('job_key'))
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        if not job:
+            return {
+                'statusCode': 404,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Job not found'}),
+                'isBase64Encoded': False
+            }
+        return {
+            'statusCode': 200,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'job': job}),
+            'isBase64Encoded': False
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -29,101 +567,91 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
+    if params.get('action') == 'worker':
+        worker_token = os.environ.get('WORKER_TOKEN')
+        if not worker_token or (headers.get('X-Worker-Token') or headers.get('x-worker-token')) != worker_token:
+            return {
+                'statusCode': 403,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': 'Forbidden'}),
+                'isBase64Encoded': False
+            }
+        try:
+            stats = run_worker(lambda prompt, provider, hedge: generate_code_coalesced(prompt, provider, hedge)[:3])
+        except Exception as e:
+            return {
+                'statusCode': 500,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        return {
+            'statusCode': 200,
+            'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+            'body': json.dumps({'success': True, **stats}),
+            'isBase64Encoded': False
+        }
+    
     try:
         body_data = json.loads(event.get('body', '{}'))
-        prompt = body_data.get('prompt', '').strip()
-        ai_provider = body_data.get('aiProvider', 'deepseek')
+        accept_encoding = headers.get('Accept-Encoding') or headers.get('accept-encoding') or ''
         
-        if not prompt:
+        # Проверка и стоимость до списания: пакет стоит столько, сколько элементов реально выполнится
+        cost, error = validate_request(body_data)
+        if error:
             return {
                 'statusCode': 400,
                 'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                'body': json.dumps({'error': 'Prompt is required'}),
+                'body': json.dumps({'error': error}),
                 'isBase64Encoded': False
             }
         
-        from openai import OpenAI
+        cached = cached_response(body_data, accept_encoding)
+        if cached is not None:
+            return cached
         
-        if ai_provider == 'openai':
-            api_key = os.environ.get('OPENAI_API_KEY')
-            base_url = None
-            model = 'gpt-4o-mini'
-            
-            if not api_key:
-                return {
-                    'statusCode': 500,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'OpenAI API key not configured'}),
-                    'isBase64Encoded': False
-                }
-        else:
-            api_key = os.environ.get('DEEPSEEK_API_KEY')
-            base_url = "https://api.deepseek.com"
-            model = 'deepseek-chat'
-            
-            if not api_key:
-                return {
-                    'statusCode': 500,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'error': 'DeepSeek API key not configured'}),
-                    'isBase64Encoded': False
-                }
+        # Тариф и отдельный ключ лимита только у пользователя с подписанным токеном:
+        # X-User-Id подставляется клиентом, с ним каждый случайный id получал бы новую квоту
+        token = get_token(headers)
+        limited_user = user_id if token and is_signed(token) else None
         
-        system_prompt = """Ты - эксперт по веб-разработке. Создай полноценный HTML-файл сайта на основе описания пользователя.
-
-Требования:
-1. Один самодостаточный HTML файл с встроенными <style> и <script>
-2. Современный дизайн с Tailwind CSS (через CDN)
-3. Адаптивная верстка
-4. Плавные анимации и hover-эффекты
-5. Чистый, читаемый код с комментариями
-6. Используй яркие цвета и градиенты где уместно
-7. Добавь интерактивность через JavaScript где нужно
-
-Верни только готовый HTML код без объяснений."""
-
-        client_args = {'api_key': api_key}
-        if base_url:
-            client_args['base_url'] = base_url
-        
-        client = OpenAI(**client_args)
-        
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"Создай сайт: {prompt}"}
-            ],
-            temperature=0.8,
-            max_tokens=4000
-        )
-        
-        generated_code = response.choices[0].message.content.strip()
-        
-        if generated_code.startswith('```html'):
-            generated_code = generated_code[7:]
-        if generated_code.startswith('```'):
-            generated_code = generated_code[3:]
-        if generated_code.endswith('```'):
-            generated_code = generated_code[:-3]
+        plan = get_plan(limited_user)
+        capacity = plan_capacity(plan)
+        if cost > capacity:
+            # Такой пакет не поместится в минутный лимит никогда: 429 с Retry-After вводил бы в заблуждение
+            return {
+                'statusCode': 413,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'error': f'Batch of {cost} exceeds the {plan} plan limit of {capacity} generations per minute',
+                    'plan': plan,
+                    'limit': capacity
+                }),
+                'isBase64Encoded': False
+            }
         
-        generated_code = generated_code.strip()
+        decision = acquire(get_subject(event, limited_user), plan, cost)
+        if not decision.allowed:
+            return {
+                'statusCode': 429,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Content-Type': 'application/json',
+                    'Retry-After': str(decision.retry_after)
+                },
+                'body': json.dumps({
+                    'error': 'Too many requests',
+                    'reason': decision.reason,
+                    'plan': decision.plan,
+                    'retry_after': decision.retry_after
+                }),
+                'isBase64Encoded': False
+            }
         
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                'success': True,
-                'code': generated_code,
-                'prompt': prompt,
-                'model': model,
-                'provider': ai_provider
-            }),
-            'isBase64Encoded': False
-        }
+        try:
+            return process_request(body_data, user_id, accept_encoding)
+        finally:
+            release(decision)
         
     except Exception as e:
         return {
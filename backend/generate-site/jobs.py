@@ -0,0 +1,148 @@
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from db import transaction
+from projects_api import save_project_code
+
+WORKER_BATCH_SIZE = int(os.environ.get('WORKER_BATCH_SIZE', '8'))
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '4'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BASE_SECONDS = int(os.environ.get('JOB_RETRY_BASE_SECONDS', '30'))
+
+PLAN_PRIORITY_SQL = "CASE plan_type WHEN 'pro' THEN 3 WHEN 'light' THEN 2 WHEN 'tokens' THEN 1 ELSE 0 END"
+
+Generator = Callable[[str, str, bool], Tuple[str, str, str]]
+
+
+def enqueue_job(user_id: Optional[Any], prompt: str, ai_provider: str, hedge: bool, project_id: Optional[int]) -> Tuple[int, Optional[str]]:
+    """
+    Постановка задачи в очередь; приоритет берётся из активной подписки пользователя.
+    Возвращает (id задачи, ключ доступа): ключ выдаётся только анонимам - статус
+    их задачи читается по нему, а не по одному лишь порядковому id.
+    """
+    access_key = None if user_id else secrets.token_urlsafe(16)
+    with transaction() as cur:
+        cur.execute(
+            f"""
+            INSERT INTO generation_jobs (user_id, project_id, prompt, ai_provider, hedge, access_key, priority)
+            VALUES (%s, %s, %s, %s, %s, %s, COALESCE((
+                SELECT MAX({PLAN_PRIORITY_SQL}) FROM subscriptions
+                WHERE user_id = %s AND status = 'active'
+                AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+            ), 0))
+            RETURNING id
+            """,
+            (user_id, project_id, prompt, ai_provider, hedge, access_key, user_id)
+        )
+        job_id = cur.fetchone()['id']
+        return job_id, access_key
+
+
+def get_job(job_id: Any, user_id: Optional[Any], access_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Задача владельца: своя для пользователя, анонимная - только по ключу доступа"""
+    with transaction() as cur:
+        cur.execute(
+            """
+            SELECT id, user_id, project_id, prompt, ai_provider, status, priority, attempts,
+                   result_code, error, run_after, created_at, started_at, finished_at
+            FROM generation_jobs
+            WHERE id = %s AND (user_id = %s OR (user_id IS NULL AND access_key = %s))
+            """,
+            (job_id, user_id, access_key)
+        )
+        job = cur.fetchone()
+    if not job:
+        return None
+    job_dict = dict(job)
+    for field in ('run_after', 'created_at', 'started_at', 'finished_at'):
+        job_dict[field] = job_dict[field].isoformat() if job_dict.get(field) else None
+    return job_dict
+
+
+def claim_jobs(limit: int) -> list:
+    """
+    Захват задач: pro > light > tokens > anonymous, внутри приоритета - FIFO.
+    Зависшие задачи с истёкшей арендой захватываются повторно, а если попытки
+    исчерпаны - помечаются failed. Отложенные повторы ждут своего run_after.
+    """
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE generation_jobs
+            SET status = 'failed', error = COALESCE(error, 'Lease expired'), locked_until = NULL,
+                finished_at = CURRENT_TIMESTAMP
+            WHERE status = 'running' AND locked_until < CURRENT_TIMESTAMP AND attempts >= %s
+            """,
+            (JOB_MAX_ATTEMPTS,)
+        )
+        cur.execute(
+            """
+            UPDATE generation_jobs
+            SET status = 'running', attempts = attempts + 1, started_at = CURRENT_TIMESTAMP,
+                locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s)
+            WHERE id IN (
+                SELECT id FROM generation_jobs
+                WHERE (status = 'queued' OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP))
+                AND attempts < %s
+                AND (run_after IS NULL OR run_after <= CURRENT_TIMESTAMP)
+                ORDER BY priority DESC, created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_id, project_id, prompt, ai_provider, hedge, attempts, result_code, priority
+            """,
+            (JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, limit)
+        )
+        jobs = [dict(job) for job in cur.fetchall()]
+    return sorted(jobs, key=lambda job: -job['priority'])
+
+
+def _finish_job(job_id: int, status: str, project_id: Optional[int], result_code: Optional[str], error: Optional[str],
+                delay_seconds: Optional[int] = None) -> None:
+    with transaction() as cur:
+        cur.execute(
+            """
+            UPDATE generation_jobs
+            SET status = %s, project_id = COALESCE(%s, project_id), result_code = COALESCE(%s, result_code),
+                error = %s, locked_until = NULL,
+                run_after = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                finished_at = CASE WHEN %s IN ('done', 'failed') THEN CURRENT_TIMESTAMP ELSE NULL END
+            WHERE id = %s
+            """,
+            (status, project_id, result_code, error, delay_seconds or 0, status, job_id)
+        )
+
+
+def retry_delay(attempts: int) -> int:
+    """Экспоненциальная пауза перед повтором: 30 с, 60 с, 120 с... при базе 30 с"""
+    return JOB_RETRY_BASE_SECONDS * (1 << max(0, attempts - 1))
+
+
+def run_job(job: Dict[str, Any], generate: Generator) -> str:
+    """Выполнение задачи: генерация (если результата ещё нет) и сохранение в проект"""
+    code = job['result_code']
+    try:
+        if code is None:
+            code, _, _ = generate(job['prompt'], job['ai_provider'], job['hedge'])
+        project_id = save_project_code(job['project_id'], job['user_id'], job['prompt'], code, f"Генерация: {job['prompt'][:200]}")
+    except Exception as e:
+        status = 'failed' if job['attempts'] >= JOB_MAX_ATTEMPTS else 'queued'
+        _finish_job(job['id'], status, None, code, str(e), retry_delay(job['attempts']) if status == 'queued' else None)
+        return status
+    _finish_job(job['id'], 'done', project_id, code, None)
+    return 'done'
+
+
+def run_worker(generate: Generator, batch_size: int = WORKER_BATCH_SIZE, concurrency: int = WORKER_CONCURRENCY) -> Dict[str, int]:
+    """Точка входа воркера: захват пачки задач и выполнение с ограниченным параллелизмом"""
+    jobs = claim_jobs(batch_size)
+    stats = {'claimed': len(jobs), 'done': 0, 'queued': 0, 'failed': 0}
+    if not jobs:
+        return stats
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(jobs)))) as pool:
+        for status in pool.map(lambda job: run_job(job, generate), jobs):
+            stats[status] += 1
+    return stats
@@ -0,0 +1,293 @@
+import gzip
+import os
+import re
+import sys
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MINIFY_ENABLED = os.environ.get('POSTPROCESS_MINIFY', '1') == '1'
+COMPRESS_MIN_BYTES = int(os.environ.get('POSTPROCESS_COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_RESPONSES = os.environ.get('POSTPROCESS_COMPRESS_RESPONSES', '0') == '1'
+HEAD_SEARCH_LIMIT = 2048
+
+_FENCE_OPEN_RE = re.compile(r'```[\w-]*')
+_HTML_START_RE = re.compile(r'<(?:!doctype|!--|[a-zA-Z])', re.IGNORECASE)
+_HTML_END_RE = re.compile(r'</html\s*>', re.IGNORECASE)
+
+
+class FenceStripper:
+    """
+    Потоковое извлечение HTML из ответа модели: отбрасывает вступительный текст,
+    обёртку ```html ... ``` и всё, что модель дописала после документа
+    """
+
+    def __init__(self):
+        self._pending = ''
+        self._state = 'head'
+        self._fenced = False
+
+    def _find_start(self, final: bool) -> bool:
+        text = self._pending.lstrip()
+        fence = _FENCE_OPEN_RE.search(text)
+        html = _HTML_START_RE.search(text)
+        if fence and (html is None or fence.start() < html.start()):
+            if fence.end() == len(text) and not final:
+                return False
+            self._pending = text[fence.end():].lstrip()
+            self._fenced = True
+        elif html:
+            self._pending = text[html.start():]
+        elif final or len(text) > HEAD_SEARCH_LIMIT:
+            self._pending = text
+        else:
+            return False
+        self._state = 'body'
+        return True
+
+    def _find_end(self) -> Optional[str]:
+        if self._fenced:
+            close = self._pending.find('```')
+            if close != -1:
+                return self._pending[:close]
+        end = _HTML_END_RE.search(self._pending)
+        if end:
+            return self._pending[:end.end()]
+        return None
+
+    def feed(self, chunk: str) -> str:
+        if self._state == 'done':
+            return ''
+        self._pending += chunk
+        if self._state == 'head' and not self._find_start(final=False):
+            return ''
+        content = self._find_end()
+        if content is not None:
+            self._state = 'done'
+            self._pending = ''
+            return content.rstrip()
+        safe_end = len(self._pending.rstrip(' \t\r\n`'))
+        if not self._fenced:
+            # Не отдаём хвост, который может оказаться началом </html>
+            last_tag = self._pending.rfind('<', max(0, safe_end - 7), safe_end)
+            if last_tag != -1 and '>' not in self._pending[last_tag:safe_end]:
+                safe_end = last_tag
+        ready, self._pending = self._pending[:safe_end], self._pending[safe_end:]
+        return ready
+
+    def finish(self) -> str:
+        if self._state == 'done':
+            return ''
+        if self._state == 'head':
+            self._find_start(final=True)
+        content = self._find_end()
+        tail = (content if content is not None else self._pending).rstrip()
+        if tail.endswith('```'):
+            tail = tail[:-3].rstrip()
+        self._pending = ''
+        self._state = 'done'
+        return tail
+
+
+_SPECIAL_OPEN_RE = re.compile(r'<!--|<(script|style|pre|textarea)(?=[\s>/])', re.IGNORECASE)
+# Строки CSS и комментарии: строки переносятся как есть, комментарии выбрасываются.
+# Комментарий без */ тянется до конца строки и продолжается на следующих
+_CSS_TOKEN_RE = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|/\*.*?(?:\*/|\Z)', re.DOTALL)
+_CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*|(?<=:)\s+')
+_SPACES_RE = re.compile(r'[ \t\f\v]+')
+RAW_MODES = ('script', 'pre', 'textarea')
+
+
+def _squeeze_css(text: str) -> str:
+    return _CSS_PUNCT_RE.sub(lambda m: m.group(1) or '', _SPACES_RE.sub(' ', text))
+
+
+class HtmlMinifier:
+    """
+    Потоковая минификация пробелов: HTML и inline CSS (кроме строк в кавычках)
+    сжимаются построчно; <script>, <pre> и <textarea> не трогаются - в JS пробелы
+    значимы внутри шаблонных строк. Переводы строк сохраняются, чтобы не склеить слова.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._mode = 'html'
+        self._css_comment = False
+        self._out_started = False
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        cut = self._buffer.rfind('\n')
+        if cut == -1:
+            return ''
+        ready, self._buffer = self._buffer[:cut + 1], self._buffer[cut + 1:]
+        return self._process(ready)
+
+    def finish(self) -> str:
+        ready, self._buffer = self._buffer, ''
+        return self._process(ready).rstrip('\n')
+
+    def _process(self, text: str) -> str:
+        out = []
+        for raw_line in text.splitlines():
+            line = self._process_line(raw_line)
+            if line is None:
+                continue
+            out.append(('\n' if self._out_started else '') + line)
+            self._out_started = True
+        return ''.join(out)
+
+    def _process_line(self, line: str) -> Optional[str]:
+        """Обработка строки; None - строку можно выбросить"""
+        started_raw = self._mode in RAW_MODES
+        result = []
+        pos = 0
+        while pos <= len(line):
+            if self._mode == 'html':
+                match = _SPECIAL_OPEN_RE.search(line, pos)
+                end = match.start() if match else len(line)
+                result.append(_SPACES_RE.sub(' ', line[pos:end]))
+                if not match:
+                    break
+                if match.group(0) == '<!--':
+                    self._mode = 'comment'
+                    pos = match.end()
+                    continue
+                tag_end = line.find('>', match.end())
+                tag_end = len(line) if tag_end == -1 else tag_end + 1
+                result.append(_SPACES_RE.sub(' ', line[match.start():tag_end]))
+                self._mode = match.group(1).lower()
+                pos = tag_end
+            elif self._mode == 'comment':
+                end = line.find('-->', pos)
+                if end == -1:
+                    break
+                self._mode = 'html'
+                pos = end + 3
+            else:
+                close = re.search(rf'</{self._mode}\s*>', line[pos:], re.IGNORECASE)
+                end = pos + close.start() if close else len(line)
+                result.append(self._raw(line[pos:end]))
+                if not close:
+                    break
+                result.append(line[end:pos + close.end()])
+                self._mode = 'html'
+                self._css_comment = False
+                pos = pos + close.end()
+        joined = ''.join(result)
+        if self._mode == 'style' and not joined.strip():
+            return None
+        if self._mode in RAW_MODES:
+            return joined if started_raw else joined.lstrip()
+        joined = joined.rstrip() if started_raw else joined.strip()
+        return joined or None
+
+    def _raw(self, text: str) -> str:
+        if self._mode != 'style':
+            return text
+        out = []
+        pos = 0
+        if self._css_comment:
+            end = text.find('*/')
+            if end == -1:
+                return ''
+            self._css_comment = False
+            pos = end + 2
+        for token in _CSS_TOKEN_RE.finditer(text, pos):
+            out.append(_squeeze_css(text[pos:token.start()]))
+            value = token.group(0)
+            if not value.startswith('/*'):
+                out.append(value)
+            elif len(value) < 4 or not value.endswith('*/'):
+                self._css_comment = True
+            pos = token.end()
+        out.append(_squeeze_css(text[pos:]))
+        return ''.join(out).strip()
+
+
+class PostProcessor:
+    """Конвейер обработки потока: снятие обёртки, затем (по флагу) минификация"""
+
+    def __init__(self, minify: bool = MINIFY_ENABLED):
+        self._stripper = FenceStripper()
+        self._minifier = HtmlMinifier() if minify else None
+
+    def feed(self, chunk: str) -> str:
+        ready = self._stripper.feed(chunk)
+        if self._minifier is None or not ready:
+            return ready
+        return self._minifier.feed(ready)
+
+    def finish(self) -> str:
+        tail = self._stripper.finish()
+        if self._minifier is None:
+            return tail
+        return self._minifier.feed(tail) + self._minifier.finish()
+
+
+def process_stream(deltas: Iterable[str], minify: bool = MINIFY_ENABLED) -> Iterator[str]:
+    processor = PostProcessor(minify)
+    for delta in deltas:
+        ready = processor.feed(delta)
+        if ready:
+            yield ready
+    tail = processor.finish()
+    if tail:
+        yield tail
+
+
+def process_code(text: str, minify: bool = MINIFY_ENABLED) -> str:
+    return ''.join(process_stream([text], minify))
+
+
+def compress(code: str, accept_encoding: str = 'br, gzip') -> Tuple[Optional[str], bytes]:
+    """Сжатие для хранения и передачи: brotli, если модуль установлен и принимается клиентом, иначе gzip"""
+    raw = code.encode()
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return None, raw
+    accepted = accept_encoding.lower()
+    if brotli is not None and 'br' in accepted:
+        return 'br', brotli.compress(raw, quality=9)
+    if 'gzip' in accepted:
+        return 'gzip', gzip.compress(raw, compresslevel=6)
+    return None, raw
+
+
+def decompress(encoding: Optional[str], data: bytes) -> str:
+    if encoding == 'br':
+        return brotli.decompress(data).decode()
+    if encoding == 'gzip':
+        return gzip.decompress(data).decode()
+    return data.decode()
+
+
+def benchmark(text: str, rounds: int = 20) -> dict:
+    """Размеры и время обработки на КБ: минификация и сжатие"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        minified = process_code(text, minify=True)
+    minify_ms = (time.perf_counter() - started) * 1000 / rounds
+    stats = {
+        'raw_bytes': len(text.encode()),
+        'minified_bytes': len(minified.encode()),
+        'minify_ms_per_kb': round(minify_ms / max(1, len(text.encode()) / 1024), 4)
+    }
+    for encoding in ('gzip', 'br'):
+        if encoding == 'br' and brotli is None:
+            continue
+        started = time.perf_counter()
+        for _ in range(rounds):
+            _, packed = compress(minified, encoding)
+        stats[f'{encoding}_bytes'] = len(packed)
+        stats[f'{encoding}_ms_per_kb'] = round((time.perf_counter() - started) * 1000 / rounds / max(1, len(minified.encode()) / 1024), 4)
+    return stats
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        with open(path, encoding='utf-8') as f:
+            print(path, benchmark(f.read()))
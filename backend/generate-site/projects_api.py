@@ -0,0 +1,58 @@
+import json
+import os
+import urllib.request
+from typing import Any, Dict, Optional
+
+from db import transaction
+from session_tokens import issue_token
+
+PROJECTS_API_URL = os.environ.get(
+    'PROJECTS_API_URL',
+    'https://functions.poehali.dev/4ef398d9-5866-48b8-bb87-02031e02a875'
+)
+PROJECTS_API_TIMEOUT = float(os.environ.get('PROJECTS_API_TIMEOUT', '15'))
+PROJECTS_TOKEN_TTL_SECONDS = 300
+
+
+def _request(method: str, body: Dict[str, Any], user_id: Optional[Any]) -> Dict[str, Any]:
+    headers = {'Content-Type': 'application/json'}
+    if user_id is not None:
+        # Воркер работает без запроса пользователя, поэтому токен выпускается здесь на короткий срок;
+        # X-User-Id остаётся только для окружений без AUTH_TOKEN_KEYS
+        try:
+            headers['Authorization'] = f"Bearer {issue_token(user_id, ttl=PROJECTS_TOKEN_TTL_SECONDS)}"
+        except RuntimeError:
+            headers['X-User-Id'] = str(user_id)
+    request = urllib.request.Request(
+        PROJECTS_API_URL,
+        data=json.dumps(body).encode(),
+        headers=headers,
+        method=method
+    )
+    with urllib.request.urlopen(request, timeout=PROJECTS_API_TIMEOUT) as response:
+        return json.loads(response.read().decode())
+
+
+def save_project_code(project_id: Optional[int], user_id: Optional[Any], prompt: str, code: str, changes_description: str) -> int:
+    """
+    Сохранение кода через функцию projects: создаёт проект или новую версию
+    существующего, чтобы вся логика версий оставалась в одном месте
+    """
+    if project_id:
+        _request('PUT', {'id': project_id, 'code': code, 'changes_description': changes_description}, user_id)
+        return project_id
+    result = _request('POST', {'name': prompt[:100] or 'Новый проект', 'prompt': prompt, 'code': code, 'status': 'draft'}, user_id)
+    return result['project_id']
+
+
+def load_project_code(project_id: Any, user_id: Optional[Any]) -> Optional[str]:
+    """Текущий код проекта владельца (только чтение, без версий); чужой проект не отличается от отсутствующего"""
+    owner_filter = "user_id = %s" if user_id else "user_id IS NULL"
+    owner_params = (user_id,) if user_id else ()
+    with transaction() as cur:
+        cur.execute(
+            f"SELECT current_code FROM projects WHERE id = %s AND {owner_filter} AND deleted_at IS NULL",
+            (project_id, *owner_params)
+        )
+        row = cur.fetchone()
+    return row['current_code'] if row else None
@@ -0,0 +1,231 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from db import connection, transaction
+
+DEFAULT_LIMITS = {
+    'anonymous': {'per_minute': 6, 'in_flight': 1},
+    'tokens': {'per_minute': 10, 'in_flight': 2},
+    'light': {'per_minute': 20, 'in_flight': 2},
+    'pro': {'per_minute': 60, 'in_flight': 4}
+}
+PLAN_LIMITS: Dict[str, Dict[str, int]] = {**DEFAULT_LIMITS, **json.loads(os.environ.get('RATE_LIMITS', '{}'))}
+
+RATE_LIMIT_POLICY = os.environ.get('RATE_LIMIT_POLICY', 'reject')
+RATE_LIMIT_QUEUE_SECONDS = float(os.environ.get('RATE_LIMIT_QUEUE_SECONDS', '10'))
+IN_FLIGHT_LEASE_SECONDS = int(os.environ.get('RATE_LIMIT_IN_FLIGHT_LEASE', '180'))
+IN_FLIGHT_RETRY_AFTER = 5
+PLAN_CACHE_SECONDS = 60
+SWEEP_INTERVAL_SECONDS = 60
+
+PLAN_PRIORITY = {'pro': 3, 'light': 2, 'tokens': 1}
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    subject: str
+    plan: str
+    retry_after: int
+    reason: Optional[str]
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def take(self, cost: float) -> float:
+        """Списание токенов; возвращает 0 при успехе или сколько секунд ждать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.refill_per_second
+
+    def is_full(self, now: float) -> bool:
+        """Ведро успело наполниться: оно ничем не отличается от нового"""
+        return self.tokens + (now - self.updated_at) * self.refill_per_second >= self.capacity
+
+
+_buckets: Dict[str, TokenBucket] = {}
+_local_in_flight: Dict[str, int] = {}
+_plans: Dict[str, Tuple[str, float]] = {}
+_lock = threading.Lock()
+_swept_at = time.monotonic()
+
+
+def _sweep(now: float) -> None:
+    """Удаление состояния простаивающих субъектов, чтобы словари не росли с каждым новым IP (под _lock)"""
+    global _swept_at
+    if now - _swept_at < SWEEP_INTERVAL_SECONDS:
+        return
+    _swept_at = now
+    for subject in [s for s, bucket in _buckets.items() if bucket.is_full(now) and not _local_in_flight.get(s)]:
+        del _buckets[subject]
+    for subject in [s for s, count in _local_in_flight.items() if not count]:
+        del _local_in_flight[subject]
+    for user_id in [u for u, (_, cached_at) in _plans.items() if now - cached_at >= PLAN_CACHE_SECONDS]:
+        del _plans[user_id]
+
+
+def _db_enabled() -> bool:
+    return bool(os.environ.get('DATABASE_URL'))
+
+
+def get_subject(event: Dict[str, Any], user_id: Optional[str]) -> str:
+    """
+    Ключ лимита: пользователь с подписанным токеном, а для остальных - IP клиента. IP берётся из
+    requestContext шлюза; в X-Forwarded-For доверяем только последнему адресу,
+    дописанному нашим прокси - левые клиент подставляет сам.
+    """
+    if user_id:
+        return f"user:{user_id}"
+    ip = ((event.get('requestContext') or {}).get('identity') or {}).get('sourceIp')
+    if not ip:
+        headers = event.get('headers') or {}
+        forwarded = headers.get('X-Forwarded-For') or headers.get('x-forwarded-for') or ''
+        ip = forwarded.split(',')[-1].strip() or 'unknown'
+    return f"ip:{ip}"
+
+
+def plan_capacity(plan: str) -> int:
+    """Наибольшая стоимость запроса, которую тариф может оплатить за минуту"""
+    return PLAN_LIMITS.get(plan, PLAN_LIMITS['anonymous'])['per_minute']
+
+
+def get_plan(user_id: Optional[str]) -> str:
+    """Тариф пользователя по активной подписке; кешируется в процессе на минуту"""
+    if not user_id or not _db_enabled():
+        return 'anonymous'
+    with _lock:
+        cached = _plans.get(user_id)
+        if cached and time.monotonic() - cached[1] < PLAN_CACHE_SECONDS:
+            return cached[0]
+    plan = 'anonymous'
+    try:
+        with transaction() as cur:
+            cur.execute(
+                """
+                SELECT plan_type FROM subscriptions
+                WHERE user_id = %s AND status = 'active'
+                AND (expires_at IS NULL OR expires_at > CURRENT_TIMESTAMP)
+                """,
+                (user_id,)
+            )
+            plans = [row['plan_type'] for row in cur.fetchall()]
+        if plans:
+            plan = max(plans, key=lambda p: PLAN_PRIORITY.get(p, 0))
+    except Exception:
+        pass
+    with _lock:
+        _plans[user_id] = (plan, time.monotonic())
+    return plan
+
+
+def _acquire_shared(subject: str, cost: int, limits: Dict[str, int]) -> Tuple[bool, int, Optional[str]]:
+    """
+    Общий для всех инстансов счётчик: окно в минуту и число запросов в работе.
+    Одна инструкция на захват; при отказе транзакция откатывается, счётчики не растут.
+    """
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            INSERT INTO rate_limits (subject, window_start, window_count, in_flight, updated_at)
+            VALUES (%s, date_trunc('minute', CURRENT_TIMESTAMP), %s, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (subject) DO UPDATE SET
+                window_count = CASE WHEN rate_limits.window_start = date_trunc('minute', CURRENT_TIMESTAMP)
+                    THEN rate_limits.window_count + EXCLUDED.window_count ELSE EXCLUDED.window_count END,
+                window_start = date_trunc('minute', CURRENT_TIMESTAMP),
+                in_flight = CASE WHEN rate_limits.updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    THEN 1 ELSE rate_limits.in_flight + 1 END,
+                updated_at = CURRENT_TIMESTAMP
+            RETURNING window_count, in_flight,
+                60 - EXTRACT(SECOND FROM CURRENT_TIMESTAMP)::int AS window_left
+            """,
+            (subject, cost, IN_FLIGHT_LEASE_SECONDS)
+        )
+        row = cur.fetchone()
+        cur.close()
+        if row['window_count'] > limits['per_minute']:
+            conn.rollback()
+            return False, max(1, row['window_left']), 'rate'
+        if row['in_flight'] > limits['in_flight']:
+            conn.rollback()
+            return False, IN_FLIGHT_RETRY_AFTER, 'in_flight'
+        conn.commit()
+        return True, 0, None
+
+
+def _release_shared(subject: str) -> None:
+    with transaction() as cur:
+        cur.execute(
+            "UPDATE rate_limits SET in_flight = GREATEST(in_flight - 1, 0), updated_at = CURRENT_TIMESTAMP WHERE subject = %s",
+            (subject,)
+        )
+
+
+def _try_acquire(subject: str, plan: str, cost: int) -> Decision:
+    limits = PLAN_LIMITS.get(plan, PLAN_LIMITS['anonymous'])
+    with _lock:
+        _sweep(time.monotonic())
+        bucket = _buckets.get(subject)
+        if bucket is None or bucket.capacity != limits['per_minute']:
+            previous = bucket
+            bucket = _buckets[subject] = TokenBucket(limits['per_minute'], limits['per_minute'] / 60.0)
+            if previous is not None:
+                # Смена тарифа не возвращает уже потраченное: новое ведро начинает с остатка старого
+                bucket.tokens = min(previous.tokens, bucket.capacity)
+                bucket.updated_at = previous.updated_at
+        wait = bucket.take(cost)
+        if wait:
+            return Decision(False, subject, plan, max(1, int(wait + 0.999)), 'rate')
+        if not _db_enabled() and _local_in_flight.get(subject, 0) >= limits['in_flight']:
+            bucket.tokens += cost
+            return Decision(False, subject, plan, IN_FLIGHT_RETRY_AFTER, 'in_flight')
+        _local_in_flight[subject] = _local_in_flight.get(subject, 0) + 1
+
+    if _db_enabled():
+        try:
+            allowed, retry_after, reason = _acquire_shared(subject, cost, limits)
+        except Exception:
+            # Недоступность счётчика не должна останавливать генерацию: остаётся локальный лимит
+            allowed, retry_after, reason = True, 0, 'local'
+        if not allowed:
+            with _lock:
+                _local_in_flight[subject] -= 1
+                if reason == 'in_flight':
+                    bucket.tokens += cost
+            return Decision(False, subject, plan, retry_after, reason)
+        return Decision(True, subject, plan, 0, reason)
+    return Decision(True, subject, plan, 0, None)
+
+
+def acquire(subject: str, plan: str, cost: int = 1) -> Decision:
+    """Допуск запроса: отказ сразу или ожидание (RATE_LIMIT_POLICY=queue) в пределах RATE_LIMIT_QUEUE_SECONDS"""
+    deadline = time.monotonic() + (RATE_LIMIT_QUEUE_SECONDS if RATE_LIMIT_POLICY == 'queue' else 0)
+    while True:
+        decision = _try_acquire(subject, plan, cost)
+        remaining = deadline - time.monotonic()
+        if decision.allowed or remaining <= 0:
+            return decision
+        time.sleep(min(remaining, decision.retry_after if decision.reason == 'rate' else 0.5))
+
+
+def release(decision: Decision) -> None:
+    if not decision.allowed:
+        return
+    with _lock:
+        _local_in_flight[decision.subject] = max(0, _local_in_flight.get(decision.subject, 1) - 1)
+    if _db_enabled() and decision.reason != 'local':
+        try:
+            _release_shared(decision.subject)
+        except Exception:
+            pass
@@ -0,0 +1,172 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from db import transaction
+
+AUTH_TOKEN_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_TTL_SECONDS', str(30 * 24 * 3600)))
+AUTH_ALLOW_USER_ID_HEADER = os.environ.get('AUTH_ALLOW_USER_ID_HEADER', '1') == '1'
+DENYLIST_REFRESH_SECONDS = float(os.environ.get('AUTH_DENYLIST_REFRESH_SECONDS', '30'))
+TOKEN_VERSION = 'v1'
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def load_keys() -> List[Tuple[str, bytes]]:
+    """
+    Ключи подписи из AUTH_TOKEN_KEYS в виде "kid:secret,kid:secret".
+    Первым ключом подписываются новые токены, остальные только проверяют - так ключ
+    меняется без разлогина: новый ставится первым, старый убирается через TTL.
+    """
+    keys = []
+    for item in os.environ.get('AUTH_TOKEN_KEYS', '').split(','):
+        kid, _, secret = item.strip().partition(':')
+        if kid and secret:
+            keys.append((kid, secret.encode()))
+    return keys
+
+
+_keys: List[Tuple[str, bytes]] = []
+_keys_by_id: Dict[str, bytes] = {}
+_keys_source: Optional[str] = None
+
+
+def _current_keys() -> Tuple[List[Tuple[str, bytes]], Dict[str, bytes]]:
+    global _keys, _keys_by_id, _keys_source
+    source = os.environ.get('AUTH_TOKEN_KEYS', '')
+    if source != _keys_source:
+        _keys = load_keys()
+        _keys_by_id = dict(_keys)
+        _keys_source = source
+    return _keys, _keys_by_id
+
+
+def _sign(key: bytes, message: str) -> str:
+    return _b64encode(hmac.new(key, message.encode(), hashlib.sha256).digest())
+
+
+def issue_token(user_id: Any, role: str = 'user', ttl: int = AUTH_TOKEN_TTL_SECONDS) -> str:
+    """Подписанный токен v1.<kid>.<claims>.<hmac>: id пользователя, роль, срок и jti для отзыва"""
+    keys, _ = _current_keys()
+    if not keys:
+        raise RuntimeError('AUTH_TOKEN_KEYS is not configured')
+    kid, key = keys[0]
+    claims = {'uid': user_id, 'role': role, 'exp': int(time.time()) + ttl, 'jti': secrets.token_urlsafe(12)}
+    body = f"{TOKEN_VERSION}.{kid}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{body}.{_sign(key, body)}"
+
+
+class Denylist:
+    """
+    Отозванные jti в памяти процесса. Полный список неистёкших записей
+    перечитывается из revoked_tokens не чаще DENYLIST_REFRESH_SECONDS;
+    при недоступности базы остаётся последний загруженный набор.
+    """
+
+    def __init__(self, refresh_seconds: float = DENYLIST_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._jtis: Set[str] = set()
+        self._loaded_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            self._loaded_at = time.monotonic()
+        try:
+            with transaction() as cur:
+                cur.execute("SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP")
+                jtis = {row['jti'] for row in cur.fetchall()}
+        except Exception:
+            return
+        with self._lock:
+            self._jtis = jtis
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            self._jtis.add(jti)
+
+    def __contains__(self, jti: str) -> bool:
+        self._refresh()
+        return jti in self._jtis
+
+
+denylist = Denylist()
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    """Claims подписанного токена или None: подпись, срок и отзыв проверяются без обращения к users"""
+    parts = token.split('.')
+    if len(parts) != 4 or parts[0] != TOKEN_VERSION:
+        return None
+    _, keys_by_id = _current_keys()
+    key = keys_by_id.get(parts[1])
+    if key is None:
+        return None
+    body = token[:token.rfind('.')]
+    if not hmac.compare_digest(_sign(key, body), parts[3]):
+        return None
+    try:
+        claims = json.loads(_b64decode(parts[2]))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get('exp', 0) < time.time() or claims.get('jti') in denylist:
+        return None
+    return claims
+
+
+def revoke_token(cur: Any, claims: Dict[str, Any]) -> None:
+    """Запись jti в revoked_tokens до истечения токена; в своём процессе отзыв действует сразу"""
+    cur.execute(
+        """
+        INSERT INTO revoked_tokens (jti, user_id, expires_at)
+        VALUES (%s, %s, to_timestamp(%s))
+        ON CONFLICT (jti) DO NOTHING
+        """,
+        (claims['jti'], claims.get('uid'), claims['exp'])
+    )
+    denylist.add(claims['jti'])
+
+
+def is_signed(token: str) -> bool:
+    return token.startswith(f"{TOKEN_VERSION}.")
+
+
+def get_token(headers: Dict[str, Any]) -> Optional[str]:
+    token = headers.get('X-Auth-Token') or headers.get('x-auth-token')
+    if token:
+        return token
+    authorization = headers.get('Authorization') or headers.get('authorization') or ''
+    if authorization.lower().startswith('bearer '):
+        return authorization[7:].strip()
+    return None
+
+
+def authenticate(headers: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Пользователь запроса: (user_id, ошибка). Подписанный токен проверяется локально;
+    пока клиенты переходят на подписанные токены, без него принимается X-User-Id,
+    а старые случайные токены игнорируются (AUTH_ALLOW_USER_ID_HEADER=0 отключает).
+    """
+    token = get_token(headers)
+    if token and (is_signed(token) or not AUTH_ALLOW_USER_ID_HEADER):
+        claims = verify_token(token)
+        if claims is None:
+            return None, 'Недействительный токен'
+        return str(claims['uid']), None
+    if AUTH_ALLOW_USER_ID_HEADER:
+        return headers.get('X-User-Id') or headers.get('x-user-id'), None
+    return None, None
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional, Tuple
+
+from cache import get_cached
+from db import transaction
+
+LEASE_SECONDS = int(os.environ.get('GENERATION_LEASE_SECONDS', '120'))
+FOLLOWER_POLL_SECONDS = float(os.environ.get('GENERATION_FOLLOWER_POLL', '0.5'))
+FOLLOWER_MAX_WAIT_SECONDS = float(os.environ.get('GENERATION_FOLLOWER_MAX_WAIT', '90'))
+
+INSTANCE_ID = uuid.uuid4().hex
+
+Result = Tuple[str, str, str]
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Result] = None
+        self.error: Optional[BaseException] = None
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+
+
+def _acquire_lease(key: str) -> Optional[bool]:
+    """True - аренда наша, False - генерация уже идёт в другом инстансе, None - БД недоступна"""
+    if not os.environ.get('DATABASE_URL'):
+        return None
+    try:
+        with transaction() as cur:
+            cur.execute(
+                """
+                INSERT INTO generation_leases (cache_key, owner, expires_at)
+                VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+                ON CONFLICT (cache_key) DO UPDATE
+                SET owner = EXCLUDED.owner, expires_at = EXCLUDED.expires_at, acquired_at = CURRENT_TIMESTAMP
+                WHERE generation_leases.expires_at < CURRENT_TIMESTAMP
+                RETURNING owner
+                """,
+                (key, INSTANCE_ID, LEASE_SECONDS)
+            )
+            return cur.fetchone() is not None
+    except Exception:
+        return None
+
+
+def _lease_active(key: str) -> bool:
+    try:
+        with transaction() as cur:
+            cur.execute(
+                "SELECT 1 FROM generation_leases WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP",
+                (key,)
+            )
+            return cur.fetchone() is not None
+    except Exception:
+        return False
+
+
+def _release_lease(key: str) -> None:
+    try:
+        with transaction() as cur:
+            cur.execute("DELETE FROM generation_leases WHERE cache_key = %s AND owner = %s", (key, INSTANCE_ID))
+    except Exception:
+        pass
+
+
+def _wait_for_remote(key: str, provider: str, model: str) -> Optional[Result]:
+    """Ожидание результата чужого инстанса через generation_cache, пока жива его аренда"""
+    deadline = time.monotonic() + FOLLOWER_MAX_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(FOLLOWER_POLL_SECONDS)
+        code = get_cached(key)
+        if code is not None:
+            return code, provider, model
+        if not _lease_active(key):
+            return None
+    return None
+
+
+def coalesce(key: str, provider: str, model: str, fn: Callable[[], Result]) -> Tuple[Result, bool]:
+    """
+    Single-flight: пока генерация по ключу идёт, одинаковые запросы ждут её
+    результат, а не запускают свою. Внутри процесса - через общий _Flight,
+    между инстансами - через аренду в generation_leases и generation_cache.
+    Возвращает результат и признак того, что он получен от чужой генерации.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, True
+
+    try:
+        lease = _acquire_lease(key)
+        shared = False
+        result = None
+        if lease is False:
+            result = _wait_for_remote(key, provider, model)
+            shared = result is not None
+        if result is None:
+            try:
+                result = fn()
+            finally:
+                if lease:
+                    _release_lease(key)
+        flight.result = result
+        return result, shared
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
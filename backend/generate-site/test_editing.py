@@ -0,0 +1,53 @@
+"""
+Тесты разбиения HTML на секции и применения патча: python -m unittest test_editing
+"""
+import unittest
+
+from editing import apply_patch, parse_patch, segment_html
+
+
+def sections(code):
+    return {s.id: s.text for s in segment_html(code) if s.id}
+
+
+class SegmentHtmlTest(unittest.TestCase):
+    def test_segments_concatenate_to_source(self):
+        code = '<html><head><title>T</title><style>p{}</style></head><body><header>H</header><main><p>A</main></body></html>'
+        self.assertEqual(''.join(s.text for s in segment_html(code)), code)
+
+    def test_unclosed_list_items_do_not_swallow_following_sections(self):
+        code = '<body><section><ul><li>A<li>B</ul></section>\n<section>C</section>\n<footer>D</footer></body>'
+        self.assertEqual(sections(code), {
+            'section-1': '<section><ul><li>A<li>B</ul></section>',
+            'section-2': '<section>C</section>',
+            'section-3': '<footer>D</footer>'
+        })
+
+    def test_unclosed_table_cells_and_options(self):
+        code = (
+            '<body><table><tr><td>1<td>2<tr><td>3</table>'
+            '<form><select><option>a<option>b</select></form><div>end</div></body>'
+        )
+        self.assertEqual(list(sections(code).values()), [
+            '<table><tr><td>1<td>2<tr><td>3</table>',
+            '<form><select><option>a<option>b</select></form>',
+            '<div>end</div>'
+        ])
+
+    def test_top_level_paragraph_without_end_tag(self):
+        code = '<body><p>first\n<p>second\n<div>block</div></body>'
+        self.assertEqual(list(sections(code).values()), ['<p>first\n', '<p>second\n', '<div>block</div>'])
+
+    def test_paragraph_closed_by_block_inside_section(self):
+        code = '<body><section><p>text<div>inner</div></section><section>next</section></body>'
+        self.assertEqual(len(sections(code)), 2)
+
+    def test_replace_keeps_later_sections(self):
+        code = '<body><section><ul><li>A<li>B</ul></section><section>C</section><footer>D</footer></body>'
+        new_code, changed = apply_patch(segment_html(code), parse_patch('<<<REPLACE section-1>>>\n<section>X</section>\n<<<END>>>'))
+        self.assertEqual(changed, ['section-1'])
+        self.assertEqual(new_code, '<body><section>X</section><section>C</section><footer>D</footer></body>')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+"""
+Тесты очереди генерации на отдельной базе со всеми миграциями:
+TEST_DATABASE_URL=postgresql://... python -m unittest test_jobs
+Функция projects подменяется локальным HTTP-стабом. Таблица generation_jobs
+очищается перед каждым тестом, поэтому рабочую базу сюда указывать нельзя.
+"""
+import json
+import os
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+
+saved_requests = []
+
+
+class ProjectsStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        saved_requests.append((self.command, self.headers.get('X-User-Id'), body, self.headers.get('Authorization')))
+        data = json.dumps({'success': True, 'project_id': body.get('id') or 777}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_POST = do_PUT = _reply
+
+
+stub = ThreadingHTTPServer(('127.0.0.1', 0), ProjectsStub)
+os.environ['PROJECTS_API_URL'] = f"http://127.0.0.1:{stub.server_address[1]}/"
+
+import jobs
+from db import transaction
+from session_tokens import verify_token
+
+
+def generate_ok(prompt, provider, hedge):
+    return f"<html>{prompt}</html>", provider, 'stub-model'
+
+
+def generate_fail(prompt, provider, hedge):
+    raise RuntimeError('upstream is down')
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class JobsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        stub.shutdown()
+
+    def setUp(self):
+        saved_requests.clear()
+        with transaction() as cur:
+            cur.execute("DELETE FROM generation_jobs")
+
+    def _job(self, job_id):
+        with transaction() as cur:
+            cur.execute("SELECT * FROM generation_jobs WHERE id = %s", (job_id,))
+            return cur.fetchone()
+
+    def _insert(self, **fields):
+        fields = {'prompt': 'сайт', **fields}
+        with transaction() as cur:
+            cur.execute(
+                f"INSERT INTO generation_jobs ({', '.join(fields)}) VALUES ({', '.join(['%s'] * len(fields))}) RETURNING id",
+                list(fields.values())
+            )
+            return cur.fetchone()['id']
+
+    def test_claims_by_priority_then_fifo(self):
+        low = self._insert(priority=0)
+        high = self._insert(priority=3)
+        middle = self._insert(priority=2)
+        self.assertEqual([job['id'] for job in jobs.claim_jobs(10)], [high, middle, low])
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+    def test_worker_saves_result_through_projects(self):
+        job_id, _ = jobs.enqueue_job(None, 'лендинг', 'deepseek', False, None)
+        stats = jobs.run_worker(generate_ok)
+        self.assertEqual(stats, {'claimed': 1, 'done': 1, 'queued': 0, 'failed': 0})
+        job = self._job(job_id)
+        self.assertEqual((job['status'], job['project_id']), ('done', 777))
+        self.assertEqual(saved_requests[0][0], 'POST')
+        self.assertEqual(saved_requests[0][2]['code'], '<html>лендинг</html>')
+
+    def test_worker_forwards_signed_token(self):
+        os.environ['AUTH_TOKEN_KEYS'] = 'k1:test-secret'
+        try:
+            jobs.enqueue_job('41', 'лендинг', 'deepseek', False, None)
+            jobs.run_worker(generate_ok)
+            _, user_header, _, authorization = saved_requests[0]
+            self.assertIsNone(user_header)
+            self.assertTrue(authorization.startswith('Bearer '))
+            self.assertEqual(str(verify_token(authorization[7:])['uid']), '41')
+        finally:
+            del os.environ['AUTH_TOKEN_KEYS']
+
+    def test_failed_attempt_is_retried_after_backoff(self):
+        job_id, _ = jobs.enqueue_job(None, 'лендинг', 'deepseek', False, None)
+        self.assertEqual(jobs.run_worker(generate_fail)['queued'], 1)
+        job = self._job(job_id)
+        self.assertEqual((job['status'], job['error']), ('queued', 'upstream is down'))
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+        with transaction() as cur:
+            cur.execute("UPDATE generation_jobs SET run_after = CURRENT_TIMESTAMP - INTERVAL '1 second' WHERE id = %s", (job_id,))
+        self.assertEqual([job['id'] for job in jobs.claim_jobs(10)], [job_id])
+
+    def test_retry_delay_grows_exponentially(self):
+        base = jobs.JOB_RETRY_BASE_SECONDS
+        self.assertEqual([jobs.retry_delay(n) for n in (1, 2, 3)], [base, base * 2, base * 4])
+
+    def test_last_attempt_fails_instead_of_requeue(self):
+        job_id = self._insert(status='queued', attempts=jobs.JOB_MAX_ATTEMPTS - 1)
+        self.assertEqual(jobs.run_worker(generate_fail)['failed'], 1)
+        self.assertEqual(self._job(job_id)['status'], 'failed')
+
+    def test_expired_lease_is_reclaimed(self):
+        job_id = self._insert(status='running', attempts=1)
+        with transaction() as cur:
+            cur.execute("UPDATE generation_jobs SET locked_until = CURRENT_TIMESTAMP - INTERVAL '1 second' WHERE id = %s", (job_id,))
+        claimed = jobs.claim_jobs(10)
+        self.assertEqual([(job['id'], job['attempts']) for job in claimed], [(job_id, 2)])
+
+    def test_expired_lease_on_last_attempt_is_failed(self):
+        job_id = self._insert(status='running', attempts=jobs.JOB_MAX_ATTEMPTS)
+        with transaction() as cur:
+            cur.execute("UPDATE generation_jobs SET locked_until = CURRENT_TIMESTAMP - INTERVAL '1 second' WHERE id = %s", (job_id,))
+        self.assertEqual(jobs.claim_jobs(10), [])
+        job = self._job(job_id)
+        self.assertEqual((job['status'], job['error']), ('failed', 'Lease expired'))
+        self.assertIsNotNone(job['finished_at'])
+
+    def test_job_is_visible_to_owner_only(self):
+        job_id, access_key = jobs.enqueue_job('41', 'лендинг', 'deepseek', False, None)
+        self.assertIsNone(access_key)
+        self.assertEqual(jobs.get_job(job_id, '41')['id'], job_id)
+        self.assertIsNone(jobs.get_job(job_id, '42'))
+        self.assertIsNone(jobs.get_job(job_id, None))
+
+    def test_anonymous_job_needs_access_key(self):
+        job_id, access_key = jobs.enqueue_job(None, 'лендинг', 'deepseek', False, None)
+        self.assertTrue(access_key)
+        self.assertEqual(jobs.get_job(job_id, None, access_key)['id'], job_id)
+        self.assertIsNone(jobs.get_job(job_id, None))
+        self.assertIsNone(jobs.get_job(job_id, None, 'wrong'))
+        self.assertIsNone(jobs.get_job(job_id, '41'))
+
+
+class WorkerActionTest(unittest.TestCase):
+    def _call(self, token=None):
+        import index
+        headers = {'X-Worker-Token': token} if token else {}
+        return index.handler({'httpMethod': 'POST', 'queryStringParameters': {'action': 'worker'}, 'headers': headers}, None)
+
+    def test_worker_requires_configured_token(self):
+        previous = os.environ.pop('WORKER_TOKEN', None)
+        try:
+            self.assertEqual(self._call()['statusCode'], 403)
+            self.assertEqual(self._call('anything')['statusCode'], 403)
+            os.environ['WORKER_TOKEN'] = 'secret'
+            self.assertEqual(self._call('wrong')['statusCode'], 403)
+        finally:
+            os.environ.pop('WORKER_TOKEN', None)
+            if previous is not None:
+                os.environ['WORKER_TOKEN'] = previous
+
+    def test_invalid_signed_token_is_rejected(self):
+        import index
+        response = index.handler({'httpMethod': 'POST', 'headers': {'Authorization': 'Bearer v1.k1.e30.bad'}, 'body': '{}'}, None)
+        self.assertEqual(response['statusCode'], 401)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,15 +3,8 @@ import os
 import hashlib
 from typing import Dict, Any
 from datetime import datetime, timedelta
-import psycopg2
-from psycopg2.extras import RealDictCursor
-
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(
-        os.environ['DATABASE_URL'],
-        cursor_factory=RealDictCursor
-    )
+from db import get_db_connection, release_db_connection
+from session_tokens import authenticate
 
 def generate_robokassa_signature(merchant_login: str, amount: str, invoice_id: str, password: str) -> str:
     """Генерация подписи для Robokassa"""
@@ -38,7 +31,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Authorization',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -50,7 +43,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur = conn.cursor()
         
         headers = event.get('headers') or {}
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+        user_id, auth_error = authenticate(headers)
+        if auth_error:
+            return {
+                'statusCode': 401,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': auth_error}),
+                'isBase64Encoded': False
+            }
         
         merchant_login = os.environ.get('ROBOKASSA_MERCHANT_LOGIN', 'demo')
         password1 = os.environ.get('ROBOKASSA_PASSWORD1', 'password1')
@@ -507,4 +507,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_MAX_AGE_SECONDS = float(os.environ.get('DB_MAX_AGE_SECONDS', '300'))
+DB_PING_IDLE_SECONDS = float(os.environ.get('DB_PING_IDLE_SECONDS', '5'))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '5'))
+
+
+class ConnectionPool:
+    """
+    Пул подключений на уровне модуля: переживает тёплые вызовы функции.
+    При выдаче подключение проверяется (закрыто ли, не истёк ли срок жизни,
+    SELECT 1 после простоя), при возврате незавершённая транзакция откатывается.
+    Если все подключения заняты, открывается временное, которое закрывается при возврате.
+    """
+
+    def __init__(self, dsn: str, max_size: int = DB_POOL_SIZE, max_age: float = DB_MAX_AGE_SECONDS,
+                 ping_idle: float = DB_PING_IDLE_SECONDS):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.max_age = max_age
+        self.ping_idle = ping_idle
+        self._idle: List[Tuple[Any, float]] = []
+        self._born: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'reuses': 0, 'discards': 0}
+
+    def _connect(self) -> Any:
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor, connect_timeout=DB_CONNECT_TIMEOUT)
+        with self._lock:
+            self._born[id(conn)] = time.monotonic()
+            self.stats['connects'] += 1
+        return conn
+
+    def _expired(self, conn: Any) -> bool:
+        return time.monotonic() - self._born.get(id(conn), 0) > self.max_age
+
+    def _alive(self, conn: Any, idle_for: float) -> bool:
+        if conn.closed or self._expired(conn):
+            return False
+        if idle_for < self.ping_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn: Any) -> None:
+        with self._lock:
+            self._born.pop(id(conn), None)
+            self.stats['discards'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self) -> Any:
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, returned_at = self._idle.pop()
+            if self._alive(conn, time.monotonic() - returned_at):
+                with self._lock:
+                    self.stats['reuses'] += 1
+                return conn
+            self._discard(conn)
+        return self._connect()
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        if not discard and not conn.closed and conn.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        if discard or conn.closed or self._expired(conn):
+            self._discard(conn)
+            return
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._discard(conn)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    dsn = os.environ['DATABASE_URL']
+    with _pool_lock:
+        if _pool is None or _pool.dsn != dsn:
+            _pool = ConnectionPool(dsn)
+        return _pool
+
+
+def get_db_connection():
+    """Подключение к базе данных из пула; вернуть через release_db_connection"""
+    return get_pool().getconn()
+
+
+def release_db_connection(conn: Any, discard: bool = False) -> None:
+    get_pool().putconn(conn, discard)
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    """Подключение из пула на время блока; после сетевой ошибки подключение не возвращается в пул"""
+    conn = get_db_connection()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        release_db_connection(conn, discard)
+
+
+@contextmanager
+def transaction() -> Iterator[Any]:
+    """Курсор в транзакции: commit при успешном выходе из блока, rollback при исключении"""
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                pass
+            raise
+        finally:
+            cur.close()
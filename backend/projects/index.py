@@ -1,15 +1,68 @@
+import base64
+import hashlib
 import json
 import os
-from typing import Dict, Any, Optional
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+from db import get_db_connection, release_db_connection
+from session_tokens import authenticate
+from versions import (
+    VERSION_PAGE_SIZE, VERSION_PAGE_MAX, VERSION_RANGE_MAX,
+    store_blob, load_version_range, list_versions, compact_project, collect_blobs
+)
+from operations import (
+    BULK_MAX_OPERATIONS, BULK_OPERATIONS, DELETED_RETENTION_HOURS, PURGE_CHUNK_SIZE, PURGE_CHUNK_MAX,
+    update_project, apply_bulk, purge_deleted_projects
+)
+from payload_cache import project_cache
+from search import SEARCH_PAGE_SIZE, SEARCH_PAGE_MAX, decode_search_cursor, search_projects
+
+PROJECTS_PAGE_SIZE = 50
+PROJECTS_PAGE_MAX = 100
+
+
+def encode_cursor(updated_at: datetime, project_id: int) -> str:
+    """Курсор keyset-пагинации: позиция последней отданной строки в порядке (updated_at, id)"""
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{project_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    updated_at, project_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(updated_at), int(project_id)
+
+
+def page_limit(value: Any, default: int, maximum: int) -> int:
+    """Размер страницы из параметра запроса в пределах 1..maximum; ValueError, если это не целое число"""
+    return max(1, min(int(default if value is None else value), maximum))
+
+
+def make_etag(*parts: Any) -> str:
+    """Сильный ETag из признаков версии ответа (updated_at, параметры страницы)"""
+    return '"' + hashlib.sha256('|'.join(str(p) for p in parts).encode()).hexdigest()[:32] + '"'
+
+
+def etag_matches(headers: Dict[str, Any], etag: str) -> bool:
+    header = headers.get('If-None-Match') or headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return etag in [tag.strip().removeprefix('W/') for tag in header.split(',')]
+
+
+def not_modified(etag: str) -> Dict[str, Any]:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'ETag': etag,
+            'Cache-Control': 'no-cache'
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
 
-def get_db_connection():
-    """Создание подключения к базе данных"""
-    return psycopg2.connect(
-        os.environ['DATABASE_URL'],
-        cursor_factory=RealDictCursor
-    )
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -23,7 +76,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, Authorization, X-Worker-Token, If-None-Match',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -35,15 +88,159 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         cur = conn.cursor()
         
         headers = event.get('headers') or {}
-        user_id = headers.get('X-User-Id') or headers.get('x-user-id')
+        user_id, auth_error = authenticate(headers)
+        if auth_error:
+            return {
+                'statusCode': 401,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'error': auth_error}),
+                'isBase64Encoded': False
+            }
         
         if method == 'GET':
             params = event.get('queryStringParameters') or {}
             project_id = params.get('id')
             
+            if params.get('action') == 'cache_stats':
+                worker_token = os.environ.get('WORKER_TOKEN')
+                if not worker_token or (headers.get('X-Worker-Token') or headers.get('x-worker-token')) != worker_token:
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Forbidden'}),
+                        'isBase64Encoded': False
+                    }
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps(project_cache.stats()),
+                    'isBase64Encoded': False
+                }
+            
+            if params.get('action') == 'search':
+                query = (params.get('q') or '').strip()
+                try:
+                    limit = page_limit(params.get('limit'), SEARCH_PAGE_SIZE, SEARCH_PAGE_MAX)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'limit must be an integer'}),
+                        'isBase64Encoded': False
+                    }
+                try:
+                    after = decode_search_cursor(params['cursor']) if params.get('cursor') else None
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Invalid cursor'}),
+                        'isBase64Encoded': False
+                    }
+                
+                owner_filter = "user_id = %s" if user_id else "user_id IS NULL"
+                owner_params = (user_id,) if user_id else ()
+                projects, next_cursor = search_projects(cur, owner_filter, owner_params, query, after, limit)
+                
+                for p in projects:
+                    p['created_at'] = p['created_at'].isoformat() if p.get('created_at') else None
+                    p['updated_at'] = p['updated_at'].isoformat() if p.get('updated_at') else None
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'projects': projects, 'next_cursor': next_cursor}),
+                    'isBase64Encoded': False
+                }
+            
+            if project_id and (params.get('version') or params.get('from')):
+                try:
+                    first = int(params.get('version') or params.get('from'))
+                    last = int(params.get('version') or params.get('to') or first)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'version, from and to must be integers'}),
+                        'isBase64Encoded': False
+                    }
+                if last < first or last - first + 1 > VERSION_RANGE_MAX:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': f'Range must contain 1-{VERSION_RANGE_MAX} versions'}),
+                        'isBase64Encoded': False
+                    }
+                
+                codes = load_version_range(cur, int(project_id), first, last)
+                if not codes:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Version not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if params.get('version'):
+                    body = {'project_id': int(project_id), 'version_number': first, 'code': codes[first]}
+                else:
+                    body = {
+                        'project_id': int(project_id),
+                        'versions': [{'version_number': v, 'code': codes[v]} for v in sorted(codes, reverse=True)]
+                    }
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps(body),
+                    'isBase64Encoded': False
+                }
+            
             if project_id:
+                try:
+                    versions_cursor = int(params['versions_cursor']) if params.get('versions_cursor') else None
+                    versions_limit = page_limit(params.get('versions_limit'), VERSION_PAGE_SIZE, VERSION_PAGE_MAX)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'versions_cursor and versions_limit must be integers'}),
+                        'isBase64Encoded': False
+                    }
+                
+                # Опрос редактора: сначала только updated_at, без кода и без project_versions
+                cur.execute("SELECT updated_at FROM projects WHERE id = %s AND deleted_at IS NULL", (project_id,))
+                stamp = cur.fetchone()
+                
+                if not stamp:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Project not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                etag = make_etag('project', project_id, stamp['updated_at'], versions_cursor, versions_limit)
+                if etag_matches(headers, etag):
+                    return not_modified(etag)
+                
+                cache_key = (int(project_id), versions_cursor, versions_limit)
+                body = project_cache.get(cache_key, stamp['updated_at'])
+                if body is not None:
+                    return {
+                        'statusCode': 200,
+                        'headers': {
+                            'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Expose-Headers': 'ETag',
+                            'Content-Type': 'application/json',
+                            'ETag': etag,
+                            'Cache-Control': 'no-cache'
+                        },
+                        'body': body,
+                        'isBase64Encoded': False
+                    }
+                
                 cur.execute(
-                    "SELECT * FROM projects WHERE id = %s",
+                    "SELECT * FROM projects WHERE id = %s AND deleted_at IS NULL",
                     (project_id,)
                 )
                 project = cur.fetchone()
@@ -56,40 +253,89 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                cur.execute(
-                    "SELECT * FROM project_versions WHERE project_id = %s ORDER BY version_number DESC",
-                    (project_id,)
+                versions, next_cursor = list_versions(
+                    cur, project['id'], versions_cursor, versions_limit
                 )
-                versions = cur.fetchall()
                 
                 result = dict(project)
-                result['versions'] = [dict(v) for v in versions]
+                result.pop('search_vector', None)
+                result['versions'] = versions
+                result['versions_next_cursor'] = next_cursor
                 result['created_at'] = result['created_at'].isoformat() if result.get('created_at') else None
                 result['updated_at'] = result['updated_at'].isoformat() if result.get('updated_at') else None
                 
                 for v in result['versions']:
                     v['created_at'] = v['created_at'].isoformat() if v.get('created_at') else None
                 
+                body = json.dumps(result)
+                project_cache.set(cache_key, stamp['updated_at'], body)
+                
                 return {
                     'statusCode': 200,
-                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps(result),
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Expose-Headers': 'ETag',
+                        'Content-Type': 'application/json',
+                        'ETag': etag,
+                        'Cache-Control': 'no-cache'
+                    },
+                    'body': body,
                     'isBase64Encoded': False
                 }
             else:
-                if user_id:
-                    cur.execute(
-                        "SELECT id, name, description, prompt, status, thumbnail_url, created_at, updated_at FROM projects WHERE user_id = %s ORDER BY updated_at DESC LIMIT 50",
-                        (user_id,)
-                    )
-                else:
-                    cur.execute(
-                        "SELECT id, name, description, prompt, status, thumbnail_url, created_at, updated_at FROM projects WHERE user_id IS NULL ORDER BY updated_at DESC LIMIT 50"
-                    )
+                try:
+                    limit = page_limit(params.get('limit'), PROJECTS_PAGE_SIZE, PROJECTS_PAGE_MAX)
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'limit must be an integer'}),
+                        'isBase64Encoded': False
+                    }
+                try:
+                    after = decode_cursor(params['cursor']) if params.get('cursor') else None
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                        'body': json.dumps({'error': 'Invalid cursor'}),
+                        'isBase64Encoded': False
+                    }
+                
+                after_at, after_id = after if after else (None, None)
+                owner_filter = "user_id = %s" if user_id else "user_id IS NULL"
+                owner_params = (user_id,) if user_id else ()
+                
+                # Удаление и восстановление сдвигают updated_at, поэтому MAX берётся по всем строкам,
+                # включая удалённые; count(*) меняется, когда очистка убирает проект совсем.
+                # deleted_at лежит в индексе (INCLUDE), так что запрос обходится index-only scan
+                cur.execute(
+                    f"""
+                    SELECT MAX(updated_at) AS last_updated, COUNT(*) FILTER (WHERE deleted_at IS NULL) AS total
+                    FROM projects WHERE {owner_filter}
+                    """,
+                    owner_params
+                )
+                stamp = cur.fetchone()
+                etag = make_etag('list', user_id, stamp['last_updated'], stamp['total'], params.get('cursor'), limit)
+                if etag_matches(headers, etag):
+                    return not_modified(etag)
+                
+                cur.execute(
+                    f"""
+                    SELECT id, name, description, prompt, status, thumbnail_url, created_at, updated_at
+                    FROM projects
+                    WHERE {owner_filter} AND deleted_at IS NULL AND (%s::timestamp IS NULL OR (updated_at, id) < (%s, %s))
+                    ORDER BY updated_at DESC, id DESC
+                    LIMIT %s
+                    """,
+                    owner_params + (after_at, after_at, after_id, limit + 1)
+                )
                 projects = cur.fetchall()
+                next_cursor = encode_cursor(projects[limit - 1]['updated_at'], projects[limit - 1]['id']) if len(projects) > limit else None
                 
                 result = []
-                for p in projects:
+                for p in projects[:limit]:
                     project_dict = dict(p)
                     project_dict['created_at'] = project_dict['created_at'].isoformat() if project_dict.get('created_at') else None
                     project_dict['updated_at'] = project_dict['updated_at'].isoformat() if project_dict.get('updated_at') else None
@@ -97,10 +343,158 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 return {
                     'statusCode': 200,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Expose-Headers': 'ETag',
+                        'Content-Type': 'application/json',
+                        'ETag': etag,
+                        'Cache-Control': 'no-cache'
+                    },
+                    'body': json.dumps({'projects': result, 'next_cursor': next_cursor}),
+                    'isBase64Encoded': False
+                }
+        
+        elif method == 'POST' and (event.get('queryStringParameters') or {}).get('action') == 'compact':
+            worker_token = os.environ.get('WORKER_TOKEN')
+            if not worker_token or (headers.get('X-Worker-Token') or headers.get('x-worker-token')) != worker_token:
+                return {
+                    'statusCode': 403,
                     'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
-                    'body': json.dumps({'projects': result}),
+                    'body': json.dumps({'error': 'Forbidden'}),
                     'isBase64Encoded': False
                 }
+            
+            body_data = json.loads(event.get('body') or '{}')
+            after_id = int(body_data.get('after_id', 0))
+            limit = min(int(body_data.get('limit', 50)), 500)
+            
+            cur.execute(
+                "SELECT id FROM projects WHERE id > %s AND deleted_at IS NULL ORDER BY id LIMIT %s",
+                (after_id, limit)
+            )
+            project_ids = [row['id'] for row in cur.fetchall()]
+            
+            totals = {'projects': 0, 'versions': 0, 'bytes_before': 0, 'bytes_after': 0}
+            for pid in project_ids:
+                stats = compact_project(cur, pid)
+                conn.commit()
+                totals['projects'] += 1
+                for key in ('versions', 'bytes_before', 'bytes_after'):
+                    totals[key] += stats[key]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'success': True,
+                    **totals,
+                    'next_after_id': project_ids[-1] if len(project_ids) == limit else None
+                }),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST' and (event.get('queryStringParameters') or {}).get('action') == 'restore':
+            body_data = json.loads(event.get('body') or '{}')
+            project_id = body_data.get('id')
+            
+            if not project_id:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': 'Project ID is required'}),
+                    'isBase64Encoded': False
+                }
+            
+            cur.execute(
+                """
+                UPDATE projects SET deleted_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND deleted_at IS NOT NULL
+                RETURNING id
+                """,
+                (project_id,)
+            )
+            
+            if not cur.fetchone():
+                return {
+                    'statusCode': 404,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': 'Deleted project not found'}),
+                    'isBase64Encoded': False
+                }
+            
+            conn.commit()
+            project_cache.invalidate(project_id)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'success': True, 'project_id': int(project_id), 'message': 'Project restored'}),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST' and (event.get('queryStringParameters') or {}).get('action') == 'purge':
+            worker_token = os.environ.get('WORKER_TOKEN')
+            if not worker_token or (headers.get('X-Worker-Token') or headers.get('x-worker-token')) != worker_token:
+                return {
+                    'statusCode': 403,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': 'Forbidden'}),
+                    'isBase64Encoded': False
+                }
+            
+            body_data = json.loads(event.get('body') or '{}')
+            limit = min(int(body_data.get('limit', PURGE_CHUNK_SIZE)), PURGE_CHUNK_MAX)
+            max_chunks = min(int(body_data.get('chunks', 10)), 100)
+            
+            # Каждая порция - отдельная короткая транзакция
+            totals = {'projects': 0, 'blobs': 0, 'blob_bytes': 0}
+            more = True
+            for _ in range(max_chunks):
+                purged, hashes = purge_deleted_projects(cur, DELETED_RETENTION_HOURS * 3600, limit)
+                blobs = collect_blobs(cur, hashes)
+                conn.commit()
+                totals['projects'] += purged
+                totals['blobs'] += blobs['blobs']
+                totals['blob_bytes'] += blobs['bytes']
+                if purged < limit:
+                    more = False
+                    break
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({'success': True, **totals, 'more': more}),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST' and (event.get('queryStringParameters') or {}).get('action') == 'bulk':
+            body_data = json.loads(event.get('body') or '{}')
+            operations = body_data.get('operations')
+            
+            if not isinstance(operations, list) or not operations or len(operations) > BULK_MAX_OPERATIONS:
+                return {
+                    'statusCode': 400,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({'error': f'operations must be a non-empty list of at most {BULK_MAX_OPERATIONS} items'}),
+                    'isBase64Encoded': False
+                }
+            
+            results = apply_bulk(cur, operations, user_id)
+            conn.commit()
+            for r in results:
+                if r.get('project_id') and r['op'] != 'create':
+                    project_cache.invalidate(r['project_id'])
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                'body': json.dumps({
+                    'success': all(r['success'] for r in results),
+                    'execution_order': list(BULK_OPERATIONS),
+                    'results': results
+                }),
+                'isBase64Encoded': False
+            }
         
         elif method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
@@ -111,24 +505,22 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             code = body_data.get('code', '')
             status = body_data.get('status', 'draft')
             
+            blob_hash, _ = store_blob(cur, code, None)
             cur.execute(
                 """
-                INSERT INTO projects (name, description, prompt, current_code, status, user_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                RETURNING id
+                WITH created AS (
+                    INSERT INTO projects (name, description, prompt, current_code, status, user_id, last_version)
+                    VALUES (%s, %s, %s, %s, %s, %s, 1)
+                    RETURNING id
+                )
+                INSERT INTO project_versions (project_id, version_number, storage, content_hash, size_bytes, changes_description)
+                SELECT id, 1, 'blob', %s, %s, %s FROM created
+                RETURNING project_id
                 """,
-                (name, description, prompt, code, status, user_id)
+                (name, description, prompt, code, status, user_id, blob_hash, len(code.encode()), 'Начальная версия')
             )
             
-            project_id = cur.fetchone()['id']
-            
-            cur.execute(
-                """
-                INSERT INTO project_versions (project_id, version_number, code, changes_description)
-                VALUES (%s, %s, %s, %s)
-                """,
-                (project_id, 1, code, 'Начальная версия')
-            )
+            project_id = cur.fetchone()['project_id']
             
             conn.commit()
             
@@ -138,6 +530,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'project_id': project_id,
+                    'version_number': 1,
                     'message': 'Project created successfully'
                 }),
                 'isBase64Encoded': False
@@ -155,7 +548,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cur.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
+            cur.execute("SELECT * FROM projects WHERE id = %s AND deleted_at IS NULL", (project_id,))
             project = cur.fetchone()
             
             if not project:
@@ -166,43 +559,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            name = body_data.get('name', project['name'])
-            description = body_data.get('description', project['description'])
-            code = body_data.get('code')
-            status = body_data.get('status', project['status'])
-            changes_description = body_data.get('changes_description', 'Обновление проекта')
-            
-            cur.execute(
-                """
-                UPDATE projects 
-                SET name = %s, description = %s, status = %s, current_code = COALESCE(%s, current_code), updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-                """,
-                (name, description, status, code, project_id)
-            )
+            version_number, unchanged_code, written = update_project(cur, project, body_data)
             
-            if code:
-                cur.execute(
-                    "SELECT COALESCE(MAX(version_number), 0) + 1 as next_version FROM project_versions WHERE project_id = %s",
-                    (project_id,)
-                )
-                next_version = cur.fetchone()['next_version']
-                
-                cur.execute(
-                    """
-                    INSERT INTO project_versions (project_id, version_number, code, changes_description)
-                    VALUES (%s, %s, %s, %s)
-                    """,
-                    (project_id, next_version, code, changes_description)
-                )
+            # Автосохранение без изменений: ни новой версии, ни записи в projects
+            if not written:
+                return {
+                    'statusCode': 200,
+                    'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
+                    'body': json.dumps({
+                        'success': True,
+                        'version_number': version_number,
+                        'unchanged': True,
+                        'message': 'Project is up to date'
+                    }),
+                    'isBase64Encoded': False
+                }
             
             conn.commit()
+            project_cache.invalidate(project['id'])
             
             return {
                 'statusCode': 200,
                 'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
                 'body': json.dumps({
                     'success': True,
+                    'version_number': version_number,
+                    'unchanged': unchanged_code,
                     'message': 'Project updated successfully'
                 }),
                 'isBase64Encoded': False
@@ -220,10 +602,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cur.execute("SELECT * FROM projects WHERE id = %s", (project_id,))
-            project = cur.fetchone()
+            # Мягкое удаление: строки убирает очистка (action=purge) после DELETED_RETENTION_HOURS
+            cur.execute(
+                """
+                UPDATE projects SET deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND deleted_at IS NULL
+                RETURNING id
+                """,
+                (project_id,)
+            )
             
-            if not project:
+            if not cur.fetchone():
                 return {
                     'statusCode': 404,
                     'headers': {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'},
@@ -231,10 +620,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            cur.execute("DELETE FROM project_versions WHERE project_id = %s", (project_id,))
-            cur.execute("DELETE FROM projects WHERE id = %s", (project_id,))
-            
             conn.commit()
+            project_cache.invalidate(project_id)
             
             return {
                 'statusCode': 200,
@@ -265,4 +652,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
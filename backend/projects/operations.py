@@ -0,0 +1,232 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from versions import content_hash, store_blob, latest_hash
+
+BULK_MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', '1000'))
+# Порядок выполнения операций внутри пакета
+BULK_OPERATIONS = ('create', 'update', 'delete')
+# Текстовые поля операций и ограничения длины столбцов projects
+BULK_TEXT_FIELDS = {'name': 255, 'description': None, 'prompt': None, 'code': None, 'status': 50, 'changes_description': None}
+DELETED_RETENTION_HOURS = float(os.environ.get('DELETED_RETENTION_HOURS', '72'))
+PURGE_CHUNK_SIZE = 100
+PURGE_CHUNK_MAX = 1000
+
+
+def update_project(cur: Any, project: Dict[str, Any], body_data: Dict[str, Any]) -> Tuple[Optional[int], bool, bool]:
+    """
+    Изменение проекта и при новом коде - новая версия.
+    Возвращает (номер последней версии, код не изменился, были ли записи в БД).
+    """
+    name = body_data.get('name', project['name'])
+    description = body_data.get('description', project['description'])
+    code = body_data.get('code')
+    status = body_data.get('status', project['status'])
+    changes_description = body_data.get('changes_description', 'Обновление проекта')
+
+    base_hash = latest_hash(cur, project['id'], project['last_version']) if code else None
+    unchanged_code = base_hash is not None and base_hash == content_hash(code)
+    version_number = project['last_version'] or None
+
+    # Автосохранение без изменений: ни новой версии, ни записи в projects
+    if unchanged_code and (name, description, status) == (project['name'], project['description'], project['status']):
+        return version_number, True, False
+
+    if code and not unchanged_code:
+        blob_hash, _ = store_blob(cur, code, base_hash)
+        # Номер версии выдаёт счётчик в projects: блокировка строки проекта
+        # упорядочивает параллельные сохранения, обновление и вставка - один запрос
+        cur.execute(
+            """
+            WITH bumped AS (
+                UPDATE projects
+                SET name = %s, description = %s, status = %s, current_code = %s,
+                    last_version = last_version + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING id, last_version
+            )
+            INSERT INTO project_versions (project_id, version_number, storage, content_hash, size_bytes, changes_description)
+            SELECT id, last_version, 'blob', %s, %s, %s FROM bumped
+            RETURNING version_number
+            """,
+            (name, description, status, code, project['id'], blob_hash, len(code.encode()), changes_description)
+        )
+        version_number = cur.fetchone()['version_number']
+    else:
+        cur.execute(
+            """
+            UPDATE projects
+            SET name = %s, description = %s, status = %s, current_code = COALESCE(%s, current_code), updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (name, description, status, code, project['id'])
+        )
+    return version_number, unchanged_code, True
+
+
+def _bulk_create(cur: Any, items: List[Tuple[int, Dict[str, Any]]], user_id: Optional[str], results: List[Dict[str, Any]]) -> None:
+    """Создание проектов пачкой: id заранее из последовательности, вставки через execute_values"""
+    cur.execute(
+        "SELECT nextval(pg_get_serial_sequence('projects', 'id')) AS id FROM generate_series(1, %s)",
+        (len(items),)
+    )
+    ids = [row['id'] for row in cur.fetchall()]
+
+    blobs: Dict[str, Tuple[Any, ...]] = {}
+    projects_rows, version_rows = [], []
+    for project_id, (index, item) in zip(ids, items):
+        code = item.get('code') or ''
+        blob_hash = content_hash(code)
+        size = len(code.encode())
+        blobs.setdefault(blob_hash, (blob_hash, 'full', code, 0, 0, size, size))
+        projects_rows.append((
+            project_id, item.get('name', 'Новый проект'), item.get('description', ''), item.get('prompt', ''),
+            code, item.get('status', 'draft'), user_id, 1
+        ))
+        version_rows.append((project_id, 1, 'blob', blob_hash, size, item.get('changes_description', 'Начальная версия')))
+        results[index] = {'index': index, 'op': 'create', 'success': True, 'project_id': project_id, 'version_number': 1}
+
+    # Одинаковые шаблоны ложатся в один блоб; существующие блокируются от сборщика (как в store_blob)
+    cur.execute("SELECT hash FROM version_blobs WHERE hash = ANY(%s) FOR SHARE", (list(blobs),))
+    for row in cur.fetchall():
+        del blobs[row['hash']]
+    if blobs:
+        execute_values(
+            cur,
+            """
+            INSERT INTO version_blobs (hash, storage, code, chain_length, chain_bytes, size_bytes, stored_bytes)
+            VALUES %s ON CONFLICT (hash) DO NOTHING
+            """,
+            list(blobs.values()),
+            page_size=500
+        )
+    execute_values(
+        cur,
+        "INSERT INTO projects (id, name, description, prompt, current_code, status, user_id, last_version) VALUES %s",
+        projects_rows,
+        page_size=500
+    )
+    execute_values(
+        cur,
+        """
+        INSERT INTO project_versions (project_id, version_number, storage, content_hash, size_bytes, changes_description)
+        VALUES %s
+        """,
+        version_rows,
+        page_size=500
+    )
+
+
+def _bulk_delete(cur: Any, items: List[Tuple[int, Dict[str, Any]]], user_id: Optional[str], results: List[Dict[str, Any]]) -> None:
+    project_ids = list({int(item['id']) for _, item in items})
+    cur.execute(
+        """
+        UPDATE projects SET deleted_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s) AND user_id IS NOT DISTINCT FROM %s AND deleted_at IS NULL
+        RETURNING id
+        """,
+        (project_ids, user_id)
+    )
+    deleted = {row['id'] for row in cur.fetchall()}
+    for index, item in items:
+        if int(item['id']) in deleted:
+            results[index] = {'index': index, 'op': 'delete', 'success': True, 'project_id': int(item['id'])}
+        else:
+            results[index] = {'index': index, 'op': 'delete', 'success': False, 'project_id': int(item['id']), 'error': 'Project not found'}
+
+
+def validate_operation(item: Any) -> Optional[str]:
+    """Ошибка элемента пакета или None: проверяется всё, из-за чего запрос упал бы на весь пакет"""
+    if not isinstance(item, dict) or item.get('op') not in BULK_OPERATIONS:
+        return f"op must be one of: {', '.join(BULK_OPERATIONS)}"
+    if item['op'] != 'create':
+        try:
+            int(item.get('id'))
+        except (TypeError, ValueError):
+            return 'Project ID is required'
+    if item['op'] != 'delete':
+        for field, max_length in BULK_TEXT_FIELDS.items():
+            if field not in item or (field == 'code' and item[field] is None):
+                continue
+            if not isinstance(item[field], str):
+                return f'{field} must be a string'
+            if max_length and len(item[field]) > max_length:
+                return f'{field} must be at most {max_length} characters'
+    return None
+
+
+def apply_bulk(cur: Any, operations: List[Any], user_id: Optional[str]) -> List[Dict[str, Any]]:
+    """
+    Пакет операций в одной транзакции: создания вставляются пачками, изменения
+    идут по одному (им нужна база дельты), удаления - одним запросом на весь пакет.
+    Порядок выполнения - все создания, затем изменения, затем удаления, а не порядок
+    в запросе: изменение и удаление одного проекта в пакете дают удалённый проект.
+    Результаты идут в порядке запроса. Некорректные элементы получают ошибку и не выполняются.
+    Изменяются и удаляются только проекты вызывающего; чужие выглядят как отсутствующие.
+    """
+    results: List[Dict[str, Any]] = [{} for _ in operations]
+    creates, updates, deletes = [], [], []
+    for index, item in enumerate(operations):
+        error = validate_operation(item)
+        if error:
+            results[index] = {'index': index, 'op': item.get('op') if isinstance(item, dict) else None, 'success': False, 'error': error}
+        elif item['op'] == 'create':
+            creates.append((index, item))
+        elif item['op'] == 'update':
+            updates.append((index, item))
+        else:
+            deletes.append((index, item))
+
+    if creates:
+        _bulk_create(cur, creates, user_id, results)
+
+    for index, item in updates:
+        cur.execute(
+            "SELECT * FROM projects WHERE id = %s AND user_id IS NOT DISTINCT FROM %s AND deleted_at IS NULL FOR UPDATE",
+            (int(item['id']), user_id)
+        )
+        project = cur.fetchone()
+        if not project:
+            results[index] = {'index': index, 'op': 'update', 'success': False, 'project_id': int(item['id']), 'error': 'Project not found'}
+            continue
+        version_number, unchanged, _ = update_project(cur, project, item)
+        results[index] = {
+            'index': index, 'op': 'update', 'success': True, 'project_id': project['id'],
+            'version_number': version_number, 'unchanged': unchanged
+        }
+
+    if deletes:
+        _bulk_delete(cur, deletes, user_id, results)
+
+    return results
+
+
+def purge_deleted_projects(cur: Any, older_than_seconds: float, limit: int) -> Tuple[int, List[str]]:
+    """
+    Окончательное удаление порции проектов, удалённых раньше older_than_seconds назад.
+    Один запрос: версии уходят каскадом по внешнему ключу. Возвращает число проектов
+    и хеши их версий - кандидатов для collect_blobs.
+    """
+    cur.execute(
+        """
+        WITH doomed AS (
+            SELECT id FROM projects
+            WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ORDER BY deleted_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        ),
+        purged AS (
+            DELETE FROM projects WHERE id IN (SELECT id FROM doomed) RETURNING id
+        )
+        SELECT
+            (SELECT COUNT(*) FROM purged) AS projects,
+            ARRAY(SELECT DISTINCT content_hash FROM project_versions
+                  WHERE project_id IN (SELECT id FROM doomed) AND content_hash IS NOT NULL) AS hashes
+        """,
+        (older_than_seconds, limit)
+    )
+    row = cur.fetchone()
+    return row['projects'], row['hashes']
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+PROJECT_CACHE_BYTES = int(os.environ.get('PROJECT_CACHE_BYTES', str(32 * 1024 * 1024)))
+PROJECT_CACHE_TTL_SECONDS = float(os.environ.get('PROJECT_CACHE_TTL_SECONDS', '300'))
+
+CacheKey = Tuple[int, Optional[str], int]
+
+
+class PayloadCache:
+    """
+    LRU готовых JSON-ответов GET ?id= с ограничением по объёму и сроку жизни.
+    Запись годна, пока updated_at проекта совпадает с сохранённым: так другие
+    инстансы видят чужие изменения ценой одного точечного запроса к projects.
+    """
+
+    def __init__(self, max_bytes: int = PROJECT_CACHE_BYTES, ttl: float = PROJECT_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.used = 0
+        self._items: 'OrderedDict[CacheKey, Tuple[Any, str, float]]' = OrderedDict()
+        self._by_project: Dict[int, Set[CacheKey]] = {}
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _drop(self, key: CacheKey) -> None:
+        _, body, _ = self._items.pop(key)
+        self.used -= len(body)
+        keys = self._by_project.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_project[key[0]]
+
+    def get(self, key: CacheKey, updated_at: Any) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.counters['misses'] += 1
+                return None
+            stamp, body, stored_at = item
+            if stamp != updated_at or time.monotonic() - stored_at > self.ttl:
+                self._drop(key)
+                self.counters['stale'] += 1
+                self.counters['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.counters['hits'] += 1
+            return body
+
+    def set(self, key: CacheKey, updated_at: Any, body: str) -> None:
+        # json.dumps экранирует не-ASCII, поэтому длина строки равна числу байт
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = (updated_at, body, time.monotonic())
+            self._by_project.setdefault(key[0], set()).add(key)
+            self.used += len(body)
+            while self.used > self.max_bytes and self._items:
+                self._drop(next(iter(self._items)))
+                self.counters['evictions'] += 1
+
+    def invalidate(self, project_id: Any) -> None:
+        with self._lock:
+            for key in list(self._by_project.get(int(project_id), ())):
+                self._drop(key)
+                self.counters['invalidations'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_ratio': round(self.counters['hits'] / lookups, 4) if lookups else None,
+                'entries': len(self._items),
+                'bytes': self.used,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl
+            }
+
+
+project_cache = PayloadCache()
@@ -0,0 +1,62 @@
+import base64
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_MAX_TERMS = 8
+
+_TERM_RE = re.compile(r'\w+')
+
+
+def build_tsquery(query: str) -> Tuple[str, List[str]]:
+    """
+    SQL-выражение tsquery и параметры: каждое слово ищется как префикс (набор текста),
+    в русской или английской конфигурации; слова объединяются через И
+    """
+    terms = _TERM_RE.findall(query.lower())[:SEARCH_MAX_TERMS]
+    parts, params = [], []
+    for term in terms:
+        parts.append("(to_tsquery('russian', %s) || to_tsquery('english', %s))")
+        params += [f"{term}:*", f"{term}:*"]
+    return ' && '.join(parts), params
+
+
+def encode_search_cursor(rank: float, project_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{rank!r}|{project_id}".encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    rank, project_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return float(rank), int(project_id)
+
+
+def search_projects(cur: Any, owner_filter: str, owner_params: Tuple[Any, ...], query: str,
+                    after: Optional[Tuple[float, int]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Проекты владельца по релевантности (ts_rank), затем по id.
+    Курсор - (rank, id) последней отданной строки, как keyset в списке проектов.
+    """
+    tsquery, query_params = build_tsquery(query)
+    if not tsquery:
+        return [], None
+    after_rank, after_id = after if after else (None, None)
+    cur.execute(
+        f"""
+        WITH q AS (SELECT {tsquery} AS query),
+        matched AS (
+            SELECT p.id, p.name, p.description, p.prompt, p.status, p.thumbnail_url, p.created_at, p.updated_at,
+                   ts_rank(p.search_vector, q.query) AS rank
+            FROM projects p, q
+            WHERE {owner_filter} AND p.deleted_at IS NULL AND p.search_vector @@ q.query
+        )
+        SELECT * FROM matched
+        WHERE %s::real IS NULL OR (rank, id) < (%s::real, %s)
+        ORDER BY rank DESC, id DESC
+        LIMIT %s
+        """,
+        tuple(query_params) + owner_params + (after_rank, after_rank, after_id, limit + 1)
+    )
+    rows = [dict(row) for row in cur.fetchall()]
+    next_cursor = encode_search_cursor(rows[limit - 1]['rank'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return rows[:limit], next_cursor
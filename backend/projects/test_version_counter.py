@@ -0,0 +1,74 @@
+"""
+Нагрузочная проверка счётчика версий на отдельной базе со всеми миграциями:
+TEST_DATABASE_URL=postgresql://... python -m unittest test_version_counter
+Параллельные PUT одного проекта через handler не должны выдавать одинаковые номера.
+"""
+import json
+import os
+import threading
+import unittest
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+
+import index
+from db import transaction
+
+THREADS = 20
+SAVES_PER_THREAD = 25
+
+
+def call(method, body, user_id='1'):
+    response = index.handler({'httpMethod': method, 'headers': {'X-User-Id': user_id}, 'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class VersionCounterTest(unittest.TestCase):
+    def test_concurrent_saves_get_distinct_numbers(self):
+        status, created = call('POST', {'name': 'stress', 'code': '<html>0</html>'})
+        self.assertEqual(status, 201)
+        project_id = created['project_id']
+
+        numbers, errors = [], []
+        lock = threading.Lock()
+
+        def save(thread):
+            for n in range(SAVES_PER_THREAD):
+                status, body = call('PUT', {'id': project_id, 'code': f"<html>{thread}-{n}</html>"})
+                with lock:
+                    if status == 200:
+                        numbers.append(body['version_number'])
+                    else:
+                        errors.append((status, body))
+
+        threads = [threading.Thread(target=save, args=(t,)) for t in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        total = THREADS * SAVES_PER_THREAD
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(numbers), list(range(2, total + 2)))
+        with transaction() as cur:
+            cur.execute(
+                """
+                SELECT p.last_version, COUNT(v.*) AS versions, COUNT(DISTINCT v.version_number) AS numbers
+                FROM projects p JOIN project_versions v ON v.project_id = p.id
+                WHERE p.id = %s GROUP BY p.last_version
+                """,
+                (project_id,)
+            )
+            row = cur.fetchone()
+        self.assertEqual((row['last_version'], row['versions'], row['numbers']), (total + 1, total + 1, total + 1))
+
+    def test_unchanged_code_does_not_add_version(self):
+        _, created = call('POST', {'name': 'same', 'code': '<html>same</html>'})
+        status, body = call('PUT', {'id': created['project_id'], 'code': '<html>same</html>'})
+        self.assertEqual((status, body['version_number'], body['unchanged']), (200, 1, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+
+KEYFRAME_INTERVAL = int(os.environ.get('VERSION_KEYFRAME_INTERVAL', '20'))
+MATERIALIZED_CACHE_BYTES = int(os.environ.get('VERSION_CACHE_BYTES', str(16 * 1024 * 1024)))
+VERSION_PAGE_SIZE = 50
+VERSION_PAGE_MAX = 200
+VERSION_RANGE_MAX = 20
+
+
+def content_hash(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def make_delta(base: str, target: str) -> bytes:
+    """
+    Построчная дельта base -> target: [start, end] - копия строк base,
+    строка - вставленный текст. Сериализуется в JSON и сжимается zlib.
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    ops: List[Any] = []
+    matcher = SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append(''.join(target_lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, ensure_ascii=False, separators=(',', ':')).encode(), 6)
+
+
+def apply_delta(base: str, delta: bytes) -> str:
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in json.loads(zlib.decompress(bytes(delta)).decode()):
+        parts.append(''.join(base_lines[op[0]:op[1]]) if isinstance(op, list) else op)
+    return ''.join(parts)
+
+
+class MaterializedCache:
+    """
+    LRU восстановленного кода по хешу содержимого с ограничением по объёму.
+    Содержимое по хешу неизменно, поэтому инвалидация не нужна.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._items: 'OrderedDict[str, str]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_hash: str) -> Optional[str]:
+        with self._lock:
+            code = self._items.get(blob_hash)
+            if code is not None:
+                self._items.move_to_end(blob_hash)
+            return code
+
+    def set(self, blob_hash: str, code: str) -> None:
+        with self._lock:
+            if blob_hash in self._items:
+                self._items.move_to_end(blob_hash)
+                return
+            self._items[blob_hash] = code
+            self.used += len(code)
+            while self.used > self.max_bytes and self._items:
+                _, evicted = self._items.popitem(last=False)
+                self.used -= len(evicted)
+
+
+materialized = MaterializedCache(MATERIALIZED_CACHE_BYTES)
+
+
+def store_blob(cur: Any, code: str, base_hash: Optional[str]) -> Tuple[str, int]:
+    """
+    Сохранение содержимого в version_blobs; возвращает хеш и число записанных байт
+    (0, если такой блоб уже есть - например, у форка или копии шаблона).
+    Новый блоб пишется дельтой от base_hash, а ключевым кадром - когда цепочка
+    длиннее KEYFRAME_INTERVAL или дельты в сумме тяжелее полного текста.
+    """
+    blob_hash = content_hash(code)
+    # FOR SHARE: сборщик (collect_blobs) пропускает блоб, пока ссылка на него не закоммичена
+    cur.execute("SELECT 1 FROM version_blobs WHERE hash = %s FOR SHARE", (blob_hash,))
+    if cur.fetchone():
+        return blob_hash, 0
+
+    full_size = len(code.encode())
+    storage, delta, chain_length, chain_bytes = 'full', None, 0, 0
+    base = None
+    if base_hash and base_hash != blob_hash:
+        cur.execute("SELECT chain_length, chain_bytes FROM version_blobs WHERE hash = %s", (base_hash,))
+        base = cur.fetchone()
+    if base and base['chain_length'] + 1 < KEYFRAME_INTERVAL:
+        base_code = load_blob(cur, base_hash)
+        packed = make_delta(base_code, code) if base_code is not None else None
+        if packed is not None and base['chain_bytes'] + len(packed) < full_size:
+            storage, delta = 'delta', packed
+            chain_length, chain_bytes = base['chain_length'] + 1, base['chain_bytes'] + len(packed)
+
+    stored_bytes = len(delta) if delta is not None else full_size
+    cur.execute(
+        """
+        INSERT INTO version_blobs (hash, storage, code, delta, base_hash, chain_length, chain_bytes, size_bytes, stored_bytes)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (hash) DO NOTHING
+        """,
+        (
+            blob_hash, storage,
+            code if delta is None else None,
+            psycopg2.Binary(delta) if delta is not None else None,
+            base_hash if delta is not None else None,
+            chain_length, chain_bytes, full_size, stored_bytes
+        )
+    )
+    return blob_hash, stored_bytes if cur.rowcount else 0
+
+
+def latest_hash(cur: Any, project_id: int, last_version: int) -> Optional[str]:
+    """Хеш последней версии: точечный поиск по уникальному (project_id, version_number)"""
+    cur.execute(
+        "SELECT content_hash FROM project_versions WHERE project_id = %s AND version_number = %s",
+        (project_id, last_version)
+    )
+    row = cur.fetchone()
+    return row['content_hash'] if row else None
+
+
+def load_blob(cur: Any, blob_hash: str) -> Optional[str]:
+    """Код по хешу: из кеша или восстановлением цепочки дельт от ключевого кадра (один запрос)"""
+    cached = materialized.get(blob_hash)
+    if cached is not None:
+        return cached
+    cur.execute(
+        """
+        WITH RECURSIVE chain AS (
+            SELECT hash, storage, code, delta, base_hash, 0 AS depth FROM version_blobs WHERE hash = %s
+            UNION ALL
+            SELECT b.hash, b.storage, b.code, b.delta, b.base_hash, chain.depth + 1
+            FROM version_blobs b JOIN chain ON b.hash = chain.base_hash
+            WHERE chain.storage = 'delta'
+        )
+        SELECT hash, storage, code, delta FROM chain ORDER BY depth DESC
+        """,
+        (blob_hash,)
+    )
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    code: Optional[str] = None
+    for row in rows:
+        cached = materialized.get(row['hash'])
+        if cached is not None:
+            code = cached
+            continue
+        if row['storage'] == 'full':
+            code = row['code']
+        elif code is None:
+            raise ValueError(f"Broken delta chain at blob {row['hash']}")
+        else:
+            code = apply_delta(code, row['delta'])
+        if content_hash(code) != row['hash']:
+            raise ValueError(f"Blob {row['hash']} does not match its content")
+        materialized.set(row['hash'], code)
+    return code
+
+
+def load_version_range(cur: Any, project_id: int, first: int, last: int) -> Dict[int, str]:
+    """Код версий first..last; соседние версии обычно лежат в одной цепочке и берутся из кеша"""
+    cur.execute(
+        """
+        SELECT v.version_number, v.content_hash
+        FROM project_versions v
+        JOIN projects p ON p.id = v.project_id AND p.deleted_at IS NULL
+        WHERE v.project_id = %s AND v.version_number BETWEEN %s AND %s
+        ORDER BY v.version_number
+        """,
+        (project_id, first, last)
+    )
+    codes = {}
+    for row in cur.fetchall():
+        code = load_blob(cur, row['content_hash']) if row['content_hash'] else None
+        if code is not None:
+            codes[row['version_number']] = code
+    return codes
+
+
+def list_versions(cur: Any, project_id: int, before: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Метаданные версий без кода, от новых к старым; курсор - номер последней отданной версии"""
+    cur.execute(
+        """
+        SELECT version_number, changes_description, created_at, size_bytes, content_hash
+        FROM project_versions
+        WHERE project_id = %s AND (%s::int IS NULL OR version_number < %s)
+        ORDER BY version_number DESC
+        LIMIT %s
+        """,
+        (project_id, before, before, limit + 1)
+    )
+    rows = [dict(row) for row in cur.fetchall()]
+    next_cursor = rows[limit - 1]['version_number'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def collect_blobs(cur: Any, hashes: List[str]) -> Dict[str, int]:
+    """
+    Удаление блобов-кандидатов, на которые больше не ссылаются ни версии, ни дельты.
+    Освободившиеся базы дельт проверяются следующим проходом; блобы, заблокированные
+    сохранением (FOR SHARE в store_blob), пропускаются.
+    """
+    removed = freed = 0
+    candidates = list(hashes)
+    while candidates:
+        cur.execute(
+            """
+            DELETE FROM version_blobs b
+            WHERE b.hash IN (SELECT hash FROM version_blobs WHERE hash = ANY(%s) FOR UPDATE SKIP LOCKED)
+            AND NOT EXISTS (SELECT 1 FROM project_versions v WHERE v.content_hash = b.hash)
+            AND NOT EXISTS (SELECT 1 FROM version_blobs d WHERE d.base_hash = b.hash)
+            RETURNING b.base_hash, b.stored_bytes
+            """,
+            (candidates,)
+        )
+        rows = cur.fetchall()
+        removed += len(rows)
+        freed += sum(row['stored_bytes'] or 0 for row in rows)
+        candidates = list({row['base_hash'] for row in rows if row['base_hash']})
+    return {'blobs': removed, 'bytes': freed}
+
+
+def compact_project(cur: Any, project_id: int) -> Dict[str, int]:
+    """
+    Перецепление истории проекта: полные блобы, которые V0014 перенёс из старых
+    строк project_versions как есть, переписываются дельтами от предыдущей версии
+    по правилам store_blob. Блоб переписывается, только если от него ещё не зависят
+    другие дельты - так не растут чужие цепочки и не появляются циклы.
+    """
+    cur.execute(
+        """
+        SELECT v.version_number, v.content_hash, b.storage
+        FROM project_versions v JOIN version_blobs b ON b.hash = v.content_hash
+        WHERE v.project_id = %s ORDER BY v.version_number
+        """,
+        (project_id,)
+    )
+    rows = cur.fetchall()
+    rechained = before = after = 0
+    for base_row, row in zip(rows, rows[1:]):
+        base_hash, blob_hash = base_row['content_hash'], row['content_hash']
+        if row['storage'] != 'full' or base_hash == blob_hash:
+            continue
+        # Обе строки блокируются, и состояние читается заново: параллельное сжатие
+        # другого проекта с общими блобами могло уже перецепить одну из них
+        cur.execute(
+            """
+            SELECT hash, storage, chain_length, chain_bytes, size_bytes, stored_bytes,
+                   EXISTS (SELECT 1 FROM version_blobs d WHERE d.base_hash = version_blobs.hash) AS has_dependents
+            FROM version_blobs WHERE hash IN (%s, %s) ORDER BY hash FOR UPDATE
+            """,
+            (base_hash, blob_hash)
+        )
+        locked = {r['hash']: r for r in cur.fetchall()}
+        base, target = locked.get(base_hash), locked.get(blob_hash)
+        if not base or not target or target['storage'] != 'full' or target['has_dependents']:
+            continue
+        if base['chain_length'] + 1 >= KEYFRAME_INTERVAL:
+            continue
+        base_code, code = load_blob(cur, base_hash), load_blob(cur, blob_hash)
+        if base_code is None or code is None:
+            continue
+        packed = make_delta(base_code, code)
+        if base['chain_bytes'] + len(packed) >= target['size_bytes']:
+            continue
+        cur.execute(
+            """
+            UPDATE version_blobs
+            SET storage = 'delta', code = NULL, delta = %s, base_hash = %s,
+                chain_length = %s, chain_bytes = %s, stored_bytes = %s
+            WHERE hash = %s
+            """,
+            (psycopg2.Binary(packed), base_hash, base['chain_length'] + 1, base['chain_bytes'] + len(packed), len(packed), blob_hash)
+        )
+        rechained += 1
+        before += target['stored_bytes']
+        after += len(packed)
+    return {'versions': rechained, 'bytes_before': before, 'bytes_after': after}
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS generation_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    provider VARCHAR(50) NOT NULL,
+    model VARCHAR(100) NOT NULL,
+    code TEXT NOT NULL,
+    size_bytes INTEGER DEFAULT 0,
+    hit_count INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_cache_created_at ON generation_cache(created_at);
+CREATE INDEX IF NOT EXISTS idx_generation_cache_last_hit_at ON generation_cache(last_hit_at DESC);
+
+COMMENT ON TABLE generation_cache IS 'Generated site code keyed by normalized prompt, provider, model and system prompt hash';
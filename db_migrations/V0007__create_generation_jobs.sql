@@ -0,0 +1,24 @@
+CREATE TABLE IF NOT EXISTS generation_jobs (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    project_id INTEGER,
+    prompt TEXT NOT NULL,
+    ai_provider VARCHAR(50) DEFAULT 'deepseek',
+    hedge BOOLEAN DEFAULT FALSE,
+    status VARCHAR(20) DEFAULT 'queued',
+    priority SMALLINT DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    result_code TEXT,
+    error TEXT,
+    locked_until TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_claim ON generation_jobs(priority DESC, created_at) WHERE status IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_generation_jobs_user_id ON generation_jobs(user_id);
+
+COMMENT ON TABLE generation_jobs IS 'Asynchronous site generation queue';
+COMMENT ON COLUMN generation_jobs.status IS 'Job status: queued, running, done, failed';
+COMMENT ON COLUMN generation_jobs.priority IS 'Claim priority from subscription plan: pro 3, light 2, tokens 1, anonymous 0';
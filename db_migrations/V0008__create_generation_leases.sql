@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS generation_leases (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    owner VARCHAR(64) NOT NULL,
+    acquired_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+COMMENT ON TABLE generation_leases IS 'In-flight generation leases used to coalesce identical requests across instances';
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS rate_limits (
+    subject VARCHAR(255) PRIMARY KEY,
+    window_start TIMESTAMP NOT NULL,
+    window_count INTEGER DEFAULT 0,
+    in_flight INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE rate_limits IS 'Shared per-user/IP generation limits: requests in the current minute and requests in flight';
+COMMENT ON COLUMN rate_limits.subject IS 'user:<id> or ip:<address>';
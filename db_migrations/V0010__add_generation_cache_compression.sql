@@ -0,0 +1,6 @@
+ALTER TABLE generation_cache ADD COLUMN IF NOT EXISTS code_compressed BYTEA;
+ALTER TABLE generation_cache ADD COLUMN IF NOT EXISTS content_encoding VARCHAR(10);
+ALTER TABLE generation_cache ALTER COLUMN code DROP NOT NULL;
+
+COMMENT ON COLUMN generation_cache.code_compressed IS 'Precompressed code (gzip or br); code is NULL when this column is set';
+COMMENT ON COLUMN generation_cache.content_encoding IS 'Encoding of code_compressed: gzip or br';
@@ -0,0 +1,11 @@
+ALTER TABLE project_versions ADD COLUMN IF NOT EXISTS storage VARCHAR(10) NOT NULL DEFAULT 'full';
+ALTER TABLE project_versions ADD COLUMN IF NOT EXISTS delta BYTEA;
+ALTER TABLE project_versions ADD COLUMN IF NOT EXISTS stored_bytes INTEGER;
+ALTER TABLE project_versions ALTER COLUMN code DROP NOT NULL;
+
+UPDATE project_versions SET stored_bytes = octet_length(code) WHERE stored_bytes IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_project_versions_project_version ON project_versions(project_id, version_number);
+
+COMMENT ON COLUMN project_versions.storage IS 'full - code holds the whole document (keyframe); delta - delta holds a zlib-compressed line delta from the previous version';
+COMMENT ON COLUMN project_versions.stored_bytes IS 'Bytes actually stored: length of code for keyframes, of delta otherwise';
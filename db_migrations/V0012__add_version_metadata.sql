@@ -0,0 +1,9 @@
+ALTER TABLE project_versions ADD COLUMN IF NOT EXISTS size_bytes INTEGER;
+ALTER TABLE project_versions ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
+UPDATE project_versions
+SET size_bytes = octet_length(code), content_hash = encode(sha256(convert_to(code, 'UTF8')), 'hex')
+WHERE code IS NOT NULL AND content_hash IS NULL;
+
+COMMENT ON COLUMN project_versions.size_bytes IS 'Size of the full version document in bytes';
+COMMENT ON COLUMN project_versions.content_hash IS 'SHA-256 (hex) of the full version document';
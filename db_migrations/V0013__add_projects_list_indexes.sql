@@ -0,0 +1,4 @@
+CREATE INDEX IF NOT EXISTS idx_projects_user_updated ON projects(user_id, updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_projects_anonymous_updated ON projects(updated_at DESC, id DESC) WHERE user_id IS NULL;
+
+DROP INDEX IF EXISTS idx_projects_user_id;
@@ -0,0 +1,50 @@
+CREATE TABLE IF NOT EXISTS version_blobs (
+    hash VARCHAR(64) PRIMARY KEY,
+    storage VARCHAR(10) NOT NULL,
+    code TEXT,
+    delta BYTEA,
+    base_hash VARCHAR(64),
+    chain_length INTEGER NOT NULL DEFAULT 0,
+    chain_bytes INTEGER NOT NULL DEFAULT 0,
+    size_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_version_blobs_base_hash ON version_blobs(base_hash);
+CREATE INDEX IF NOT EXISTS idx_project_versions_content_hash ON project_versions(content_hash);
+
+COMMENT ON TABLE version_blobs IS 'Content-addressed version bodies shared by all projects: full keyframes or line deltas from base_hash';
+
+-- Ключевые кадры из project_versions
+INSERT INTO version_blobs (hash, storage, code, size_bytes, stored_bytes)
+SELECT DISTINCT ON (content_hash) content_hash, 'full', code, octet_length(code), octet_length(code)
+FROM project_versions
+WHERE storage = 'full' AND code IS NOT NULL AND content_hash IS NOT NULL
+ON CONFLICT (hash) DO NOTHING;
+
+-- Дельты: база - предыдущая версия того же проекта, формат дельты не меняется
+INSERT INTO version_blobs (hash, storage, delta, base_hash, chain_length, chain_bytes, size_bytes, stored_bytes)
+SELECT DISTINCT ON (v.content_hash)
+    v.content_hash, 'delta', v.delta, prev.content_hash,
+    v.version_number - keyframe.version_number,
+    (
+        SELECT COALESCE(SUM(octet_length(d.delta)), 0) FROM project_versions d
+        WHERE d.project_id = v.project_id AND d.storage = 'delta'
+        AND d.version_number > keyframe.version_number AND d.version_number <= v.version_number
+    ),
+    v.size_bytes, octet_length(v.delta)
+FROM project_versions v
+JOIN project_versions prev ON prev.project_id = v.project_id AND prev.version_number = v.version_number - 1
+JOIN LATERAL (
+    SELECT MAX(k.version_number) AS version_number FROM project_versions k
+    WHERE k.project_id = v.project_id AND k.storage = 'full' AND k.version_number < v.version_number
+) keyframe ON TRUE
+WHERE v.storage = 'delta' AND v.delta IS NOT NULL AND v.content_hash IS NOT NULL AND prev.content_hash IS NOT NULL
+ON CONFLICT (hash) DO NOTHING;
+
+-- Перенесённые строки больше не хранят тело; оставшиеся переносит действие compact
+UPDATE project_versions v SET storage = 'blob', code = NULL, delta = NULL
+WHERE EXISTS (SELECT 1 FROM version_blobs b WHERE b.hash = v.content_hash);
+
+ALTER TABLE project_versions ALTER COLUMN storage SET DEFAULT 'blob';
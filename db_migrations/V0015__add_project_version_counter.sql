@@ -0,0 +1,26 @@
+-- Дубликаты номеров, появившиеся из-за гонки MAX()+1, переносятся в конец истории проекта
+WITH duplicates AS (
+    SELECT id, project_id,
+           ROW_NUMBER() OVER (PARTITION BY project_id, version_number ORDER BY id) AS copy_number
+    FROM project_versions
+),
+renumbered AS (
+    SELECT d.id,
+           (SELECT MAX(version_number) FROM project_versions m WHERE m.project_id = d.project_id)
+           + ROW_NUMBER() OVER (PARTITION BY d.project_id ORDER BY d.id) AS version_number
+    FROM duplicates d
+    WHERE d.copy_number > 1
+)
+UPDATE project_versions v SET version_number = renumbered.version_number
+FROM renumbered WHERE v.id = renumbered.id;
+
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS last_version INTEGER NOT NULL DEFAULT 0;
+
+UPDATE projects p SET last_version = COALESCE(
+    (SELECT MAX(version_number) FROM project_versions v WHERE v.project_id = p.id), 0
+);
+
+ALTER TABLE project_versions ADD CONSTRAINT uq_project_versions_number UNIQUE (project_id, version_number);
+
+DROP INDEX IF EXISTS idx_project_versions_project_version;
+DROP INDEX IF EXISTS idx_project_versions_project_id;
@@ -0,0 +1,12 @@
+-- Поиск по названию, описанию и промпту: русская и английская конфигурации,
+-- вес A - название, B - описание, C - промпт
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(description, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(description, '')), 'B') ||
+    setweight(to_tsvector('russian', coalesce(prompt, '')), 'C') ||
+    setweight(to_tsvector('english', coalesce(prompt, '')), 'C')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_projects_search_vector ON projects USING GIN (search_vector);
@@ -0,0 +1,12 @@
+ALTER TABLE projects ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+-- Очередь очистки: только удалённые проекты, по времени удаления
+CREATE INDEX IF NOT EXISTS idx_projects_deleted_at ON projects(deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- Версии без проекта остались от старых удалений; без них внешний ключ не проверить
+DELETE FROM project_versions v WHERE NOT EXISTS (SELECT 1 FROM projects p WHERE p.id = v.project_id);
+
+-- NOT VALID: ключ сразу действует для новых строк, а блокировка ADD CONSTRAINT
+-- держится недолго - существующие строки проверяет V0022 отдельной миграцией
+ALTER TABLE project_versions ADD CONSTRAINT fk_project_versions_project
+    FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE NOT VALID;
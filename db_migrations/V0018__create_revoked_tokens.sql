@@ -0,0 +1,9 @@
+-- Отозванные подписанные токены (logout); строка нужна только до истечения токена
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires_at ON revoked_tokens(expires_at);
@@ -0,0 +1,2 @@
+-- Пользователи, вошедшие через Google, создаются без пароля
+ALTER TABLE users ALTER COLUMN password_hash DROP NOT NULL;
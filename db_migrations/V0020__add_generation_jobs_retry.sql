@@ -0,0 +1,10 @@
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS run_after TIMESTAMP;
+ALTER TABLE generation_jobs ADD COLUMN IF NOT EXISTS access_key VARCHAR(32);
+
+-- Задачи, чья аренда истекла на последней попытке, раньше навсегда оставались в running
+UPDATE generation_jobs
+SET status = 'failed', error = COALESCE(error, 'Lease expired'), locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+WHERE status = 'running' AND locked_until < CURRENT_TIMESTAMP AND attempts >= 3;
+
+COMMENT ON COLUMN generation_jobs.run_after IS 'Retry backoff: queued job is not claimed before this time';
+COMMENT ON COLUMN generation_jobs.access_key IS 'Secret returned to anonymous clients to read their job status';
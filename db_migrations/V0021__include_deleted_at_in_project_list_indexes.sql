@@ -0,0 +1,7 @@
+-- deleted_at в индексах списка: ETag (MAX(updated_at), число живых проектов)
+-- считается index-only scan без чтения строк projects на каждый опрос
+DROP INDEX IF EXISTS idx_projects_user_updated;
+CREATE INDEX idx_projects_user_updated ON projects(user_id, updated_at DESC, id DESC) INCLUDE (deleted_at);
+
+DROP INDEX IF EXISTS idx_projects_anonymous_updated;
+CREATE INDEX idx_projects_anonymous_updated ON projects(updated_at DESC, id DESC) INCLUDE (deleted_at) WHERE user_id IS NULL;
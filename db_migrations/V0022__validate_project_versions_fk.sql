@@ -0,0 +1,3 @@
+-- Отдельно от V0017: VALIDATE берёт SHARE UPDATE EXCLUSIVE и не мешает записи,
+-- но в одной транзакции с ADD CONSTRAINT держалась бы его более сильная блокировка
+ALTER TABLE project_versions VALIDATE CONSTRAINT fk_project_versions_project;